@@ -0,0 +1,108 @@
+"""Compare the cost of loading devices with private properties implemented
+through AbstractBase.__getattribute__ / __setattr__ (before 4.3.0) and through
+per-model descriptors (PrivateAttribute).
+
+Usage: python build/scripts/benchmark_private_properties.py [number of rows]
+"""
+
+from sqlalchemy import Column, create_engine, Integer, String
+from sqlalchemy.orm import declarative_base, Session
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+from sys import argv
+from time import perf_counter
+
+PRIVATE_PROPERTIES = {"enable_password", "password", "private_key"}
+Base = declarative_base()
+
+
+class OverrideBase(Base):
+
+    __abstract__ = True
+
+    def __getattribute__(self, property):
+        if property in PRIVATE_PROPERTIES:
+            return super().__getattribute__(property)
+        else:
+            return super().__getattribute__(property)
+
+    def __setattr__(self, property, value):
+        if property in PRIVATE_PROPERTIES:
+            if not value:
+                return
+            super().__setattr__(property, value[::-1])
+        else:
+            super().__setattr__(property, value)
+
+
+class PrivateAttribute(InstrumentedAttribute):
+
+    __slots__ = ()
+
+    def __set__(self, instance, value):
+        if not value:
+            return
+        super().__set__(instance, value[::-1])
+
+
+def device_columns():
+    return {
+        "id": Column(Integer, primary_key=True),
+        "name": Column(String(255)),
+        "ip_address": Column(String(255)),
+        "vendor": Column(String(255)),
+        "operating_system": Column(String(255)),
+        "username": Column(String(255)),
+        "password": Column(String(255)),
+        "enable_password": Column(String(255)),
+    }
+
+
+OverrideDevice = type(
+    "OverrideDevice", (OverrideBase,), {"__tablename__": "d1", **device_columns()}
+)
+DescriptorDevice = type(
+    "DescriptorDevice", (Base,), {"__tablename__": "d2", **device_columns()}
+)
+for property in PRIVATE_PROPERTIES:
+    attribute = vars(DescriptorDevice).get(property)
+    if isinstance(attribute, InstrumentedAttribute):
+        attribute.__class__ = PrivateAttribute
+
+
+def benchmark(session, model, rows):
+    session.execute(model.__table__.insert(), rows)
+    session.commit()
+    start = perf_counter()
+    devices = session.query(model).all()
+    load = perf_counter() - start
+    start = perf_counter()
+    for device in devices:
+        device.name, device.ip_address, device.vendor, device.password
+    access = perf_counter() - start
+    session.expunge_all()
+    return load, access
+
+
+if __name__ == "__main__":
+    number = int(argv[1]) if len(argv) > 1 else 100_000
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    rows = [
+        {
+            "name": f"device{index}",
+            "ip_address": f"10.0.{index // 256 % 256}.{index % 256}",
+            "vendor": "Cisco",
+            "operating_system": "IOS",
+            "username": "admin",
+            "password": "secret",
+            "enable_password": "secret",
+        }
+        for index in range(number)
+    ]
+    with Session(engine) as session:
+        for model in (OverrideDevice, DescriptorDevice):
+            load, access = benchmark(session, model, rows)
+            print(
+                f"{model.__name__:<17} load {number} rows: {load:.3f}s"
+                f" - attribute access: {access:.3f}s"
+            )
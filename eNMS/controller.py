@@ -1,6 +1,6 @@
 from collections import Counter, defaultdict
 from contextlib import redirect_stdout
-from datetime import datetime
+from datetime import datetime, timedelta
 from difflib import unified_diff
 from flask_login import current_user
 from functools import wraps
@@ -9,7 +9,7 @@ from io import BytesIO, StringIO
 from ipaddress import IPv4Network
 from json import dump, load
 from logging import info
-from operator import attrgetter, itemgetter
+from operator import itemgetter
 from os import getenv, listdir, makedirs, scandir
 from os.path import exists
 from pathlib import Path
@@ -17,13 +17,14 @@ from re import compile, error as regex_error, search, sub
 from requests import get as http_get
 from ruamel import yaml
 from shutil import rmtree
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, case, func, or_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import aliased
 from sqlalchemy.sql.expression import true
 from subprocess import Popen
 from tarfile import open as open_tar
 from threading import Thread
+from time import sleep
 from traceback import format_exc
 from uuid import uuid4
 from xlrd import open_workbook
@@ -38,6 +39,8 @@ from eNMS.variables import vs
 
 class Controller:
     def _initialize(self, first_init):
+        if vs.settings["retention"]["active"]:
+            Thread(target=self.retention_worker, daemon=True).start()
         if not first_init:
             return
         self.migration_import(
@@ -70,8 +73,8 @@ class Controller:
                 "destination": destination,
             },
         )
-        db.session.commit()
         workflow.last_modified = now
+        db.session.commit()
         return {"update_time": now, **workflow_edge}
 
     def add_instances_in_bulk(self, **kwargs):
@@ -546,14 +549,124 @@ class Controller:
     def get_result(self, id):
         return db.fetch("result", id=id).result
 
-    def get_runtimes(self, id, display=None):
-        kwargs = {"allow_none": True, "all_matches": True, "service_id": id}
+    def backfill_run_summaries(self, batch_size=1000, **_):
+        summary, result = vs.models["run_summary"], vs.models["result"]
+        summarized = (
+            db.session.query(summary.id)
+            .filter(summary.parent_runtime == result.parent_runtime)
+            .exists()
+        )
+        success_count = func.count(case([(result.success == true(), 1)]))
+        columns = (
+            "parent_runtime",
+            "service_id",
+            "run_id",
+            "creator",
+            "success_count",
+            "failure_count",
+            "min_runtime",
+        )
+        last_runtime, backfilled_runtimes = "", 0
+        while True:
+            runtimes = [
+                runtime
+                for (runtime,) in db.session.query(result.parent_runtime)
+                .filter(
+                    result.parent_runtime > last_runtime,
+                    result.service_id.isnot(None),
+                    ~summarized,
+                )
+                .distinct()
+                .order_by(result.parent_runtime)
+                .limit(batch_size)
+            ]
+            if not runtimes:
+                break
+            last_runtime = runtimes[-1]
+            summaries = (
+                db.session.query(
+                    result.parent_runtime,
+                    result.service_id,
+                    func.min(result.run_id),
+                    func.min(result.creator),
+                    success_count,
+                    func.count(result.id) - success_count,
+                    func.min(result.runtime),
+                )
+                .filter(
+                    result.parent_runtime.in_(runtimes), result.service_id.isnot(None)
+                )
+                .group_by(result.parent_runtime, result.service_id)
+            )
+            try:
+                db.session.execute(
+                    summary.__table__.insert().from_select(columns, summaries.statement)
+                )
+                db.session.commit()
+                backfilled_runtimes += len(runtimes)
+            except IntegrityError:
+                db.session.rollback()
+        env.log("info", f"Run summaries backfilled for {backfilled_runtimes} runs")
+        return {"runtimes": backfilled_runtimes}
+
+    def get_run_summaries(self, runtime):
+        summary, result = vs.models["run_summary"], vs.models["result"]
+        stored_summaries = db.session.query(
+            summary.service_id,
+            summary.success_count,
+            summary.failure_count,
+            summary.min_runtime,
+        ).filter(summary.parent_runtime == runtime)
+        summaries = {
+            service_id: values for service_id, *values in stored_summaries.all()
+        }
+        success_count = func.count(case([(result.success == true(), 1)]))
+        live_summaries = (
+            db.session.query(
+                result.service_id,
+                success_count,
+                func.count(result.id) - success_count,
+                func.min(result.runtime),
+            )
+            .filter(
+                result.parent_runtime == runtime,
+                result.service_id.notin_(list(summaries)),
+            )
+            .group_by(result.service_id)
+        )
+        for service_id, *values in live_summaries.all():
+            summaries[service_id] = values
+        return summaries
+
+    @staticmethod
+    def get_runtime_page(query, column, before=None, until=None):
+        query = query.order_by(column.desc())
+        if before:
+            query = query.filter(column < before)
+        if until:
+            return [tuple(row) for row in query.filter(column >= until).all()]
+        page_size = vs.settings["tables"]["runtime_page_size"]
+        return [tuple(row) for row in query.limit(page_size).all()]
+
+    def get_runtimes(self, id, display=None, before=None):
+        summary, run = vs.models["run_summary"], vs.models["run"]
+        summaries = (
+            db.query("run_summary", properties=["parent_runtime"])
+            .join(run, summary.run)
+            .add_columns(run.name)
+            .filter(summary.service_id == id)
+        )
+        runs = db.query("run", properties=["runtime", "name"]).filter(
+            run.service_id == id
+        )
         if display == "user":
-            kwargs["creator"] = current_user.name
-        results, runs = db.fetch("result", **kwargs), db.fetch("run", **kwargs)
-        results_runtimes = set((r.parent_runtime, r.run.name) for r in results)
-        run_runtimes = set((run.runtime, run.name) for run in runs)
-        return sorted(results_runtimes | run_runtimes, reverse=True)
+            summaries = summaries.filter(summary.creator == current_user.name)
+            runs = runs.filter(run.creator == current_user.name)
+        runtimes = set(
+            self.get_runtime_page(summaries, summary.parent_runtime, before)
+        ) | set(self.get_runtime_page(runs, run.runtime, before))
+        page_size = vs.settings["tables"]["runtime_page_size"]
+        return sorted(runtimes, reverse=True)[:page_size]
 
     def get_service_logs(self, service, runtime, line=0, device=None):
         log_instance = db.fetch(
@@ -583,18 +696,31 @@ class Controller:
         service = db.fetch("service", id=path_id[-1], allow_none=True)
         if not service:
             raise db.rbac_error
-        runs = db.query("run", rbac=None).filter(
-            vs.models["run"].service_id.in_(path_id)
-        )
+        run_table = vs.models["run"]
+        runs = db.query("run", rbac=None).filter(run_table.service_id.in_(path_id))
         if display == "user":
-            runs = runs.filter(vs.models["run"].creator == current_user.name)
-        runs = runs.all()
-        if runtime != "normal" and runs:
-            if runtime == "latest":
-                run = sorted(runs, key=attrgetter("runtime"), reverse=True)[0]
-            else:
-                run = db.fetch("run", allow_none=True, runtime=runtime)
-            state = run.get_state() if run else None
+            runs = runs.filter(run_table.creator == current_user.name)
+        if runtime == "latest":
+            run = runs.order_by(run_table.runtime.desc()).first()
+        elif runtime != "normal":
+            run = db.fetch("run", allow_none=True, runtime=runtime)
+        state = run.get_state() if run else None
+        runtimes_query = runs.with_entities(run_table.runtime, run_table.name)
+        runtimes = self.get_runtime_page(
+            runtimes_query, run_table.runtime, until=kwargs.get("oldest_runtime")
+        )
+        if kwargs.get("load_more") and runtimes:
+            runtimes.extend(
+                self.get_runtime_page(
+                    runtimes_query, run_table.runtime, before=runtimes[-1][0]
+                )
+            )
+        if run and (run.runtime, run.name) not in runtimes:
+            runtimes = sorted(runtimes + [(run.runtime, run.name)], reverse=True)
+        output["more_runtimes"] = bool(
+            runtimes
+            and runtimes_query.filter(run_table.runtime < runtimes[-1][0]).first()
+        )
         if kwargs.get("device") and run:
             output["device_state"] = {
                 result.service_id: result.success
@@ -614,9 +740,7 @@ class Controller:
                 serialized_service["services"].append(properties)
         return {
             "service": serialized_service,
-            "runtimes": sorted(
-                set((run.runtime, run.name) for run in runs), reverse=True
-            ),
+            "runtimes": runtimes,
             "state": state,
             "run": run.get_properties(include=run_properties) if run else None,
             **output,
@@ -677,25 +801,18 @@ class Controller:
     def get_workflow_results(self, path, runtime):
         run = db.fetch("run", runtime=runtime)
         service = db.fetch("service", id=path.split(">")[-1])
-        state = run.state
+        state, summaries = run.state, self.get_run_summaries(runtime)
 
         def rec(service, path):
-            results = db.fetch(
-                "result",
-                parent_runtime=runtime,
-                allow_none=True,
-                all_matches=True,
-                service_id=service.id,
-            )
-            if service.scoped_name in ("Start", "End") or not results:
+            if service.scoped_name in ("Start", "End") or service.id not in summaries:
                 return
+            _, failure_count, min_runtime = summaries[service.id]
             progress = state.get(path, {}).get("progress")
             track_progress = progress and progress["device"]["total"]
             data = {"progress": progress["device"]} if track_progress else {}
-            success = all(result.success for result in results)
-            color = "32CD32" if success else "FF6666"
+            color = "FF6666" if failure_count else "32CD32"
             result = {
-                "runtime": min(result.runtime for result in results),
+                "runtime": min_runtime,
                 "data": {"properties": service.base_properties, **data},
                 "text": service.scoped_name,
                 "a_attr": {"style": f"color: #{color};width: 100%"},
@@ -1039,19 +1156,102 @@ class Controller:
             return {"alert": f"{instance.name} is not associated with {target.name}."}
         self.update_rbac(instance)
 
+    def prune_rows(self, model, *conditions):
+        table, retention, pruned = vs.models[model], vs.settings["retention"], 0
+        properties = [table.id, table.runtime] if model == "run" else [table.id]
+        while True:
+            batch = (
+                db.session.query(*properties)
+                .filter(*conditions)
+                .order_by(table.id)
+                .limit(retention["batch_size"])
+                .all()
+            )
+            if not batch:
+                return pruned
+            ids = [row[0] for row in batch]
+            if model == "run":
+                for child in ("result", "run_summary"):
+                    child_table = vs.models[child]
+                    db.session.query(child_table).filter(
+                        child_table.run_id.in_(ids)
+                    ).delete(synchronize_session=False)
+                log = vs.models["service_log"]
+                db.session.query(log).filter(
+                    log.runtime.in_([row[1] for row in batch])
+                ).delete(synchronize_session=False)
+            db.session.query(table).filter(table.id.in_(ids)).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+            pruned += len(ids)
+            if len(ids) < retention["batch_size"]:
+                return pruned
+            sleep(retention["batch_pause"])
+
+    def apply_retention_policies(self):
+        metrics = Counter()
+        for model, policy in vs.settings["retention"]["policies"].items():
+            table = vs.models[model]
+            time_property = getattr(table, "runtime" if model == "run" else "time")
+            if policy.get("age"):
+                cutoff = str(datetime.now() - timedelta(days=policy["age"]))
+                metrics[model] += self.prune_rows(model, time_property < cutoff)
+            max_rows = policy.get("max_rows_per_service")
+            if model != "run" or not max_rows:
+                continue
+            services = (
+                db.session.query(table.service_id)
+                .group_by(table.service_id)
+                .having(func.count(table.id) > max_rows)
+                .all()
+            )
+            for (service_id,) in services:
+                cutoff = (
+                    db.session.query(table.runtime)
+                    .filter(table.service_id == service_id)
+                    .order_by(table.runtime.desc())
+                    .offset(max_rows - 1)
+                    .limit(1)
+                    .scalar()
+                )
+                metrics[model] += self.prune_rows(
+                    model, table.service_id == service_id, table.runtime < cutoff
+                )
+        metrics["blob"] = db.delete_orphaned_blobs()
+        if env.redis_queue:
+            for model, pruned in metrics.items():
+                env.redis("hincrby", "retention/metrics", model, pruned)
+            env.redis("hset", "retention/metrics", "last_run", vs.get_time())
+        summary = ", ".join(f"{count} {model}" for model, count in metrics.items())
+        env.log("info", f"Retention: pruned {summary or 'no rows'}", change_log=False)
+        return dict(metrics)
+
     def result_log_deletion(self, **kwargs):
         date_time_object = datetime.strptime(kwargs["date_time"], "%d/%m/%Y %H:%M:%S")
         date_time_string = date_time_object.strftime("%Y-%m-%d %H:%M:%S.%f")
         for model in kwargs["deletion_types"]:
-            if model == "run":
-                field_name = "runtime"
-            elif model == "changelog":
-                field_name = "time"
-            session_query = db.session.query(vs.models[model]).filter(
-                getattr(vs.models[model], field_name) < date_time_string
-            )
-            session_query.delete(synchronize_session=False)
-            db.session.commit()
+            field_name = "runtime" if model == "run" else "time"
+            time_property = getattr(vs.models[model], field_name)
+            self.prune_rows(model, time_property < date_time_string)
+
+    def retention_worker(self):
+        retention = vs.settings["retention"]
+        while True:
+            sleep(retention["interval"])
+            if env.redis_queue and not env.redis(
+                "set", "retention/lock", vs.server, nx=True, ex=retention["interval"]
+            ):
+                continue
+            try:
+                self.apply_retention_policies()
+            except Exception:
+                db.session.rollback()
+                env.log(
+                    "error", f"Retention failure:\n{format_exc()}", change_log=False
+                )
+            finally:
+                db.session.remove()
 
     @staticmethod
     def run(service, **kwargs):
@@ -2,12 +2,14 @@ from ast import literal_eval
 from atexit import register
 from contextlib import contextmanager
 from flask_login import current_user
+from hashlib import sha256
 from importlib.util import module_from_spec, spec_from_file_location
-from json import loads
+from json import dumps, loads
 from logging import error, info, warning
 from operator import attrgetter
-from os import getenv, getpid
+from os import getenv, getpid, replace, utime
 from pathlib import Path
+from pickle import dumps as pickle_dumps, loads as pickle_loads
 from re import search
 from sqlalchemy import (
     Boolean,
@@ -18,6 +20,7 @@ from sqlalchemy import (
     Float,
     inspect,
     Integer,
+    LargeBinary,
     PickleType,
     String,
     Table,
@@ -30,10 +33,17 @@ from sqlalchemy.ext.declarative import declarative_base, DeclarativeMeta
 from sqlalchemy.ext.mutable import MutableDict, MutableList
 from sqlalchemy.orm import aliased, configure_mappers, scoped_session, sessionmaker
 from sqlalchemy.orm.collections import InstrumentedList
-from sqlalchemy.types import JSON
-from time import sleep
+from sqlalchemy.types import JSON, TypeDecorator
+from time import sleep, time
 from traceback import format_exc
-from uuid import getnode
+from uuid import getnode, uuid4
+from warnings import warn
+from zlib import compress as zlib_compress, decompress as zlib_decompress
+
+try:
+    from zstandard import ZstdCompressor, ZstdDecompressor
+except ImportError as exc:
+    warn(f"Couldn't import zstandard module ({exc})")
 
 from eNMS.variables import vs
 
@@ -45,6 +55,20 @@ class Database:
         self.database_url = getenv("DATABASE_URL", "sqlite:///database.db")
         self.dialect = self.database_url.split(":")[0]
         self.rbac_error = type("RbacError", (Exception,), {})
+        self.rbac_target_properties = {
+            "access": {
+                "access_pools": ("append", "remove"),
+                "access_type": ("set",),
+                "user_pools": ("append", "remove"),
+            },
+            "pool": {"devices": ("append", "remove"), "users": ("append", "remove")},
+            "user": {"is_admin": ("set",)},
+        }
+        self.blob_references = (
+            ("result", "result", "blob"),
+            ("run", "payload", "payload_blob"),
+        )
+        self.serialization_plans = {}
         self.configure_columns()
         self.engine = create_engine(
             self.database_url,
@@ -140,7 +164,29 @@ class Database:
             if self.dialect.startswith(("mariadb", "mysql")):
                 impl = MSMediumBlob
 
+        class EncodedDictType(TypeDecorator):
+            cache_ok, impl = True, LargeBinary
+            if self.dialect.startswith(("mariadb", "mysql")):
+                impl = MSMediumBlob
+
+            def process_bind_param(_self, value, dialect):  # noqa: N805
+                if value is None or isinstance(value, bytes):
+                    return value
+                serialized_values = self.session.info.get("serialized_values", {})
+                serialized_value, content = serialized_values.pop(
+                    id(value), (None, None)
+                )
+                if serialized_value is value:
+                    return content
+                return self.serialize(value)
+
+            def process_result_value(_self, value, dialect):  # noqa: N805
+                if value is None:
+                    return value
+                return self.deserialize(value)
+
         self.Dict = MutableDict.as_mutable(CustomPickleType)
+        self.EncodedDict = MutableDict.as_mutable(EncodedDictType)
         self.List = MutableList.as_mutable(CustomPickleType)
         if self.dialect == "postgresql":
             self.LargeString = Text
@@ -151,6 +197,7 @@ class Database:
 
         default_ctypes = {
             self.Dict: {},
+            self.EncodedDict: {},
             self.List: [],
             self.LargeString: "",
             self.SmallString: "",
@@ -266,6 +313,51 @@ class Database:
         for model in vs.models.values():
             if "configure_events" in vars(model):
                 model.configure_events()
+        self.configure_private_properties()
+
+        def flag_target_change(*_):
+            self.session.info["rbac_targets_changed"] = True
+
+        for model, properties in self.rbac_target_properties.items():
+            event.listen(vs.models[model], "after_delete", flag_target_change)
+            for property, events in properties.items():
+                for event_name in events:
+                    attribute = getattr(vs.models[model], property)
+                    event.listen(attribute, event_name, flag_target_change)
+
+        def set_blob_reference(property, blob_property):
+            def serialize(mapper, connection, target):
+                if not inspect(target).attrs[property].history.has_changes():
+                    return
+                value, blob_hash = getattr(target, property), None
+                if value is not None and not isinstance(value, bytes):
+                    content = self.serialize(value)
+                    serialized_values = self.session.info.setdefault(
+                        "serialized_values", {}
+                    )
+                    serialized_values[id(value)] = (value, content)
+                    blob_hash = self.get_blob_hash(content)
+                setattr(target, blob_property, blob_hash)
+
+            return serialize
+
+        for model, property, blob_property in self.blob_references:
+            listener = set_blob_reference(property, blob_property)
+            event.listen(vs.models[model], "before_insert", listener)
+            event.listen(vs.models[model], "before_update", listener)
+
+        @event.listens_for(self.session, "after_flush_postexec")
+        def clear_serialized_values(session, flush_context):
+            session.info.pop("serialized_values", None)
+
+        @event.listens_for(self.session, "after_commit")
+        def invalidate_target_cache(session):
+            if session.info.pop("rbac_targets_changed", False):
+                env.invalidate_target_cache()
+
+        @event.listens_for(self.session, "after_rollback")
+        def discard_target_change(session):
+            session.info.pop("rbac_targets_changed", None)
 
         if env.use_vault:
             for model in vs.private_properties:
@@ -276,14 +368,19 @@ class Database:
                         return
                     for property in vs.private_properties[target.class_type]:
                         path = f"secret/data/{target.type}"
-                        data = env.vault_client.read(f"{path}/{old_name}/{property}")
+                        data = env.read_vault_secret(f"{path}/{old_name}/{property}")
                         if not data:
                             return
-                        env.vault_client.write(
+                        env.write_vault_secret(
                             f"{path}/{new_name}/{property}",
-                            data={property: data["data"]["data"][property]},
+                            {property: data["data"]["data"][property]},
                         )
-                        env.vault_client.delete(f"{path}/{old_name}")
+                        env.delete_vault_secret(f"{path}/{old_name}")
+
+    def configure_private_properties(self):
+        for model in set(vs.models.values()):
+            model.configure_private_properties()
+        self.serialization_plans.clear()
 
     def configure_associations(self):
         for name, association in self.relationships["associations"].items():
@@ -368,6 +465,18 @@ class Database:
                 f"with the following characteristics: {kwargs}"
             )
 
+    def chunks(self, values):
+        chunk_size = self.queries["in_clause_chunk_size"]
+        for index in range(0, len(values), chunk_size):
+            yield values[index : index + chunk_size]
+
+    def fetch_in(self, model, property, values, rbac="read", username=None):
+        column, instances = getattr(vs.models[model], property), []
+        for chunk in self.chunks(list(values)):
+            query = self.query(model, rbac, username=username)
+            instances.extend(query.filter(column.in_(chunk)).all())
+        return instances
+
     def delete(self, model, **kwargs):
         instance = self.fetch(model, **{"rbac": "edit", **kwargs})
         return self.delete_instance(instance)
@@ -462,6 +571,27 @@ class Database:
             raise Exception(f"No matching credentials found for DEVICE '{device.name}'")
         return credentials
 
+    def get_device_credentials(self, username, device_ids, credential_type="any"):
+        pool_alias, credentials = aliased(vs.models["pool"]), {}
+        for chunk in self.chunks(device_ids):
+            query = (
+                self.session.query(vs.models["device"].id, vs.models["credential"])
+                .select_from(vs.models["credential"])
+                .join(vs.models["pool"], vs.models["credential"].user_pools)
+                .join(vs.models["user"], vs.models["pool"].users)
+                .join(pool_alias, vs.models["credential"].device_pools)
+                .join(vs.models["device"], pool_alias.devices)
+                .filter(vs.models["user"].name == username)
+                .filter(vs.models["device"].id.in_(chunk))
+            )
+            if credential_type != "any":
+                query = query.filter(vs.models["credential"].role == credential_type)
+            for device_id, credential in query.all():
+                current = credentials.get(device_id)
+                if not current or credential.priority > current.priority:
+                    credentials[device_id] = credential
+        return credentials
+
     def register_custom_models(self):
         for model in ("device", "link", "service"):
             paths = [vs.path / "eNMS" / "models" / f"{model}s"]
@@ -526,6 +656,137 @@ class Database:
             setattr(table, property, column)
         return table
 
+    def bulk_insert(self, model, rows, commit=False):
+        def transaction():
+            if rows:
+                self.session.execute(vs.models[model].__table__.insert(), rows)
+
+        if not commit:
+            transaction()
+        else:
+            for index in range(self.retry_commit_number):
+                try:
+                    transaction()
+                    self.session.commit()
+                    break
+                except Exception as exc:
+                    self.session.rollback()
+                    if index == self.retry_commit_number - 1:
+                        error(f"Commit n°{index} failed ({format_exc()})")
+                        raise exc
+                    else:
+                        warning(f"Commit n°{index} failed ({str(exc)})")
+                    sleep(self.retry_commit_time * (index + 1))
+
+    def reset_connection_pool(self):
+        self.session.registry.clear()
+        self.engine.dispose(close=False)
+
+    @property
+    def blob_path(self):
+        return Path(self.blob_store["path"] or vs.path / "blobs")
+
+    def store_blob(self, content):
+        blob_hash = sha256(content).hexdigest()
+        path = self.blob_path / blob_hash[:2] / blob_hash
+        if path.exists():
+            utime(path)
+            return blob_hash
+        if self.blob_store["compression"] == "zstd":
+            compressor = ZstdCompressor(level=self.blob_store["compression_level"])
+            compressed_content = compressor.compress(content)
+        else:
+            compressed_content = zlib_compress(
+                content, self.blob_store["compression_level"]
+            )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(f".{uuid4().hex}.tmp")
+        temporary_path.write_bytes(compressed_content)
+        replace(temporary_path, path)
+        return blob_hash
+
+    def load_blob(self, blob_hash):
+        content = (self.blob_path / blob_hash[:2] / blob_hash).read_bytes()
+        if content[:4] == b"\x28\xb5\x2f\xfd":
+            return ZstdDecompressor().decompress(content)
+        return zlib_decompress(content)
+
+    def get_blob_hash(self, content):
+        prefix = b'{"__blob__": "'
+        if content[: len(prefix)] == prefix:
+            return content[len(prefix) : len(prefix) + 64].decode()
+
+    def get_blob_references(self, blob_hashes):
+        references = set()
+        for model, _, blob_property in self.blob_references:
+            column = getattr(vs.models[model], blob_property)
+            for index in range(0, len(blob_hashes), 1000):
+                query = self.session.query(column).filter(
+                    column.in_(blob_hashes[index : index + 1000])
+                )
+                references.update(blob_hash for (blob_hash,) in query.distinct())
+        return references
+
+    def delete_orphaned_blobs(self):
+        if not self.blob_path.exists():
+            return 0
+        cutoff, deleted = time() - self.blob_store["orphan_age"] * 86400, 0
+        candidates = [
+            path for path in self.blob_path.glob("*/*") if path.stat().st_mtime < cutoff
+        ]
+        if not candidates:
+            return 0
+        references = self.get_blob_references([path.name for path in candidates])
+        for path in candidates:
+            if path.name in references:
+                continue
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    deleted += 1
+            except FileNotFoundError:
+                continue
+        return deleted
+
+    def encode(self, value):
+        try:
+            return dumps(value, default=str).encode()
+        except TypeError:
+            return pickle_dumps(value)
+
+    def serialize(self, value, encode=None):
+        encode = encode or self.encode
+        if not self.blob_store["active"] or not isinstance(value, dict):
+            return encode(value)
+        inline_keys = self.blob_store["inline_keys"]
+        reference = {key: value[key] for key in inline_keys if key in value}
+        content = encode({k: v for k, v in value.items() if k not in reference})
+        if content[:1] == b"\x80":
+            return encode(value)
+        elif len(content) >= self.blob_store["threshold"]:
+            return dumps({"__blob__": self.store_blob(content), **reference}).encode()
+        elif not reference:
+            return content
+        # the inline keys are appended to the JSON object instead of encoding
+        # the whole value a second time
+        separator = b", " if content != b"{}" else b""
+        return content[:-1] + separator + dumps(reference, default=str).encode()[1:]
+
+    def deserialize(self, value):
+        value = bytes(value)
+        if value[:1] == b"\x80":
+            return pickle_loads(value)
+        value = loads(value)
+        if isinstance(value, dict) and "__blob__" in value:
+            blob_hash = value.pop("__blob__")
+            try:
+                content = self.load_blob(blob_hash)
+            except FileNotFoundError:
+                warning(f"Blob {blob_hash} not found in {self.blob_path}")
+                return {"error": f"Content not found (blob {blob_hash})", **value}
+            return {**loads(content), **value}
+        return value
+
     def cleanup(self):
         self.engine.dispose()
 
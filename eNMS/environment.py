@@ -1,6 +1,8 @@
+from atexit import register
 from base64 import b64decode, b64encode
 from click import get_current_context
-from collections import defaultdict
+from collections import Counter, defaultdict, deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from cryptography.fernet import Fernet
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
@@ -10,10 +12,13 @@ from flask_login import current_user
 from importlib import import_module
 from json import load
 from logging.config import dictConfig
-from logging import getLogger, info
+from logging import error, getLogger, info
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing import get_context
 from os import getenv, getpid
 from passlib.hash import argon2
 from psutil import Process
+from queue import Empty, Full, Queue, SimpleQueue
 from redis import Redis
 from redis.exceptions import ConnectionError, TimeoutError
 from requests import Session as RequestSession
@@ -23,8 +28,10 @@ from smtplib import SMTP
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import StaleDataError
 from sys import path as sys_path
-from threading import Thread
+from threading import Condition, Lock, Thread
+from time import sleep, time
 from traceback import format_exc
+from uuid import uuid4
 from warnings import warn
 from watchdog.observers.polling import PollingObserver
 from watchdog.events import FileSystemEventHandler
@@ -47,6 +54,78 @@ except ImportError as exc:
 from eNMS.database import db
 from eNMS.variables import vs
 
+ACQUIRE_SESSION_SCRIPT = """
+local ticket, start, now, timeout = ARGV[1], ARGV[2], tonumber(ARGV[3]), ARGV[4]
+local expiry, limits = ARGV[5], {}
+for index, key in ipairs(KEYS) do
+  redis.call("ZREMRANGEBYSCORE", key .. "/leases", "-inf", now)
+  limits[key] = tonumber(ARGV[index + 5])
+end
+local function is_eligible(limits)
+  for key, limit in pairs(limits) do
+    if redis.call("ZCOUNT", key .. "/leases", now, "+inf") >= limit then
+      return false
+    end
+  end
+  return true
+end
+redis.call("HSET", "governor/waiters", ticket, cjson.encode(limits))
+for index = 2, #KEYS do
+  local queue = KEYS[index] .. "/queue"
+  for _, waiter in ipairs(
+    redis.call("ZRANGEBYSCORE", queue, "-inf", now - 2 * timeout)
+  ) do
+    redis.call("ZREM", queue, waiter)
+    redis.call("HDEL", "governor/waiters", waiter)
+  end
+  if not redis.call("ZSCORE", queue, ticket) then
+    redis.call("ZADD", queue, start, ticket)
+  end
+end
+for index = 2, #KEYS do
+  for _, waiter in ipairs(redis.call("ZRANGE", KEYS[index] .. "/queue", 0, -1)) do
+    if waiter == ticket then
+      break
+    end
+    local waiter_limits = redis.call("HGET", "governor/waiters", waiter)
+    if waiter_limits and is_eligible(cjson.decode(waiter_limits)) then
+      return 0
+    end
+  end
+end
+if not is_eligible(limits) then
+  return 0
+end
+for index, key in ipairs(KEYS) do
+  redis.call("ZADD", key .. "/leases", expiry, ticket)
+  if index > 1 then
+    redis.call("ZREM", key .. "/queue", ticket)
+  end
+end
+redis.call("HDEL", "governor/waiters", ticket)
+return 1
+"""
+
+INVALIDATE_VAULT_SECRET_SCRIPT = """
+local version = redis.call("INCR", KEYS[1])
+redis.call("RPUSH", KEYS[2], ARGV[1])
+redis.call("LTRIM", KEYS[2], -tonumber(ARGV[2]), -1)
+return version
+"""
+
+SYNC_VAULT_CACHE_SCRIPT = """
+local version = tonumber(redis.call("GET", KEYS[1]) or "0")
+local known_version = tonumber(ARGV[1])
+if version == known_version then
+  return {version}
+end
+local behind = version - known_version
+if known_version < 0 or behind < 0 or behind > redis.call("LLEN", KEYS[2]) then
+  return {version, 1}
+end
+return {version, 0, unpack(redis.call("LRANGE", KEYS[2], -behind, -1))}
+"""
+
 
 class Environment:
     def __init__(self):
@@ -60,7 +139,16 @@ class Environment:
             sys_path.append(vs.settings["paths"]["custom_code"])
         self.init_logs()
         self.init_redis()
+        self.init_log_buffers()
+        self.init_changelog_writer()
+        if self.redis_queue and self.log_pipeline["run_log_buffer_size"] > 1:
+            register(self.flush_log_buffers)
+        if self.changelog_settings["active"]:
+            register(self.stop_changelog_writer)
         self.init_connection_pools()
+        self.init_session_governor()
+        self.init_device_connection_pool()
+        self.init_target_cache()
         self.file_path = vs.settings["paths"]["files"] or str(vs.path / "files")
         main_thread = Thread(target=self.monitor_filesystem)
         main_thread.daemon = True
@@ -73,7 +161,7 @@ class Environment:
                 if any(
                     event.src_path.endswith(extension)
                     for extension in vs.settings["files"]["ignored_types"]
-                ):
+                ) or event.src_path.startswith(str(db.blob_path)):
                     return
                 filetype = "folder" if event.is_directory else "file"
                 file = db.fetch(filetype, path=event.src_path, allow_none=True)
@@ -150,6 +238,196 @@ class Environment:
             password = str.encode(password)
         return str(self.decrypt(password), "utf-8")
 
+    def get_process_pool(self, max_workers, initializer, *initargs):
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=get_context("fork"),
+            initializer=initializer,
+            initargs=initargs,
+        )
+
+    def init_process_worker(self):
+        db.reset_connection_pool()
+        for connections in vs.connections_cache.values():
+            connections.clear()
+        self.restart_background_threads()
+
+    def get_session_limits(self, device, library, driver):
+        platform_limit = self.governor["platform_limits"].get(
+            driver, self.governor["max_sessions_per_platform"]
+        )
+        return {
+            "governor/sessions": self.governor["max_sessions"],
+            f"governor/device/{device}": self.governor["max_sessions_per_device"],
+            f"governor/platform/{library}/{driver}": platform_limit,
+        }
+
+    def acquire_session(self, session, device, library, driver):
+        if not self.governor["active"]:
+            return
+        limits = self.get_session_limits(device, library, driver)
+        timeout = self.governor["acquire_timeout"]
+        if self.redis_queue:
+            lease = self.acquire_redis_session(limits, timeout)
+        else:
+            lease = self.acquire_local_session(limits, timeout)
+        if not lease:
+            raise Exception(
+                f"No session available for {device} ({library} / {driver}) "
+                f"after waiting {timeout} seconds (session governor limits)."
+            )
+        self.governed_sessions[session] = (list(limits), lease)
+
+    def acquire_local_session(self, limits, timeout):
+        waiter, queued_keys = (object(), limits), list(limits)[1:]
+
+        def is_eligible(limits):
+            return all(
+                self.session_counts[key] < limit for key, limit in limits.items()
+            )
+
+        def is_available():
+            for key in queued_keys:
+                for previous_waiter in self.session_queues[key]:
+                    if previous_waiter is waiter:
+                        break
+                    if is_eligible(previous_waiter[1]):
+                        return False
+            return is_eligible(limits)
+
+        with self.session_condition:
+            for key in queued_keys:
+                self.session_queues[key].append(waiter)
+            acquired = self.session_condition.wait_for(is_available, timeout)
+            for key in queued_keys:
+                self.session_queues[key].remove(waiter)
+                if not self.session_queues[key]:
+                    self.session_queues.pop(key)
+            if acquired:
+                for key in limits:
+                    self.session_counts[key] += 1
+            self.session_condition.notify_all()
+        return acquired
+
+    def acquire_redis_session(self, limits, timeout):
+        ticket, start = str(uuid4()), time()
+        keys, args = list(limits), list(limits.values())
+        while time() - start < timeout:
+            acquired = self.redis(
+                "eval",
+                ACQUIRE_SESSION_SCRIPT,
+                len(keys),
+                *keys,
+                ticket,
+                start,
+                time(),
+                timeout,
+                time() + self.governor["lease_ttl"],
+                *args,
+            )
+            if acquired:
+                return ticket
+            sleep(self.governor["poll_interval"])
+        for key in keys[1:]:
+            self.redis("zrem", f"{key}/queue", ticket)
+        self.redis("hdel", "governor/waiters", ticket)
+
+    def release_session(self, session):
+        keys, lease = self.governed_sessions.pop(session, (None, None))
+        if not keys:
+            return
+        if self.redis_queue:
+            self.redis_pipeline(*(("zrem", f"{key}/leases", lease) for key in keys))
+        else:
+            with self.session_condition:
+                for key in keys:
+                    self.session_counts[key] -= 1
+                    if not self.session_counts[key]:
+                        self.session_counts.pop(key)
+                self.session_condition.notify_all()
+
+    def renew_session_leases(self):
+        expiry = time() + self.governor["lease_ttl"]
+        self.redis_pipeline(
+            *(
+                ("zadd", f"{key}/leases", {lease: expiry}, False, True)
+                for keys, lease in list(self.governed_sessions.values())
+                for key in keys
+            )
+        )
+
+    def session_lease_renewer(self):
+        while True:
+            sleep(self.governor["lease_ttl"] / 3)
+            try:
+                self.renew_session_leases()
+            except Exception:
+                error(f"Session lease renewal failure:\n{format_exc()}")
+
+    def transfer_session(self, session, new_session):
+        if session in self.governed_sessions:
+            self.governed_sessions[new_session] = self.governed_sessions.pop(session)
+
+    def get_expired_connections(self):
+        settings, expired = vs.settings["automation"]["connection_pool"], []
+        for connection_id, entry in list(self.connection_pool.items()):
+            if (
+                len(self.connection_pool) <= settings["max_size"]
+                and time() - entry["last_used"] < settings["idle_timeout"]
+            ):
+                break
+            expired.append(self.connection_pool.pop(connection_id))
+        return expired
+
+    def connection_pool_reaper(self):
+        settings = vs.settings["automation"]["connection_pool"]
+        while True:
+            sleep(settings["reap_interval"])
+            with self.connection_pool_lock:
+                expired = self.get_expired_connections()
+            for entry in expired:
+                self.close_pooled_connection(entry)
+
+    def checkin_connection(self, key, connection, close, session):
+        connection_id = id(connection)
+        with self.connection_pool_lock:
+            self.transfer_session(session, ("pool", connection_id))
+            self.connection_pool[connection_id] = {
+                "close": close,
+                "connection": connection,
+                "key": key,
+                "last_used": time(),
+            }
+            expired = self.get_expired_connections()
+        for entry in expired:
+            self.close_pooled_connection(entry)
+
+    def checkout_connection(self, key, session):
+        with self.connection_pool_lock:
+            expired = self.get_expired_connections()
+            entry = next(
+                (
+                    entry
+                    for entry in reversed(self.connection_pool.values())
+                    if entry["key"] == key
+                ),
+                None,
+            )
+            if entry:
+                connection_id = id(entry["connection"])
+                self.connection_pool.pop(connection_id)
+                self.transfer_session(("pool", connection_id), session)
+        for expired_entry in expired:
+            self.close_pooled_connection(expired_entry)
+        return entry
+
+    def close_pooled_connection(self, entry, session=None):
+        try:
+            entry["close"]()
+        except Exception as exc:
+            info(f"Error while closing pooled connection ({exc})")
+        self.release_session(session or ("pool", id(entry["connection"])))
+
     def get_ssh_port(self):
         if self.redis_queue:
             self.ssh_port = self.redis("incr", "ssh_port", 1)
@@ -171,6 +449,14 @@ class Environment:
         except NameError as exc:
             warn(f"Module missing ({exc})")
 
+    def init_changelog_writer(self):
+        self.changelog_settings = vs.settings["changelog"]
+        self.changelog_queue = Queue(self.changelog_settings["max_queue_size"])
+        self.changelog_metrics, self.changelog_lock = Counter(), Lock()
+        if self.changelog_settings["active"]:
+            self.changelog_thread = Thread(target=self.changelog_writer, daemon=True)
+            self.changelog_thread.start()
+
     def init_connection_pools(self):
         self.request_session = RequestSession()
         retry = Retry(**vs.settings["requests"]["retries"])
@@ -194,11 +480,41 @@ class Environment:
         with open(vs.path / "setup" / "logging.json", "r") as logging_config:
             logging_config = load(logging_config)
         dictConfig(logging_config)
+        self.log_pipeline, self.log_listeners = logging_config["pipeline"], {}
+        if self.log_pipeline["queue_listener"]:
+            for logger in logging_config["loggers"]:
+                self.start_log_listener(logger, getLogger(logger).handlers)
+            register(self.stop_log_listeners)
         for logger, log_level in logging_config["external_loggers"].items():
             info(f"Changing {logger} log level to '{log_level}'")
             log_level = getattr(import_module("logging"), log_level.upper())
             getLogger(logger).setLevel(log_level)
 
+    def init_log_buffers(self):
+        self.log_buffers, self.log_buffer_lock = defaultdict(list), Lock()
+        self.log_flush_lock = Lock()
+        if self.redis_queue and self.log_pipeline["run_log_buffer_size"] > 1:
+            Thread(target=self.log_buffer_flusher, daemon=True).start()
+
+    def start_log_listener(self, logger, handlers):
+        log_queue = SimpleQueue()
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        getLogger(logger).handlers = [QueueHandler(log_queue)]
+        listener.start()
+        self.log_listeners[logger] = listener
+
+    def stop_log_listeners(self):
+        for listener in self.log_listeners.values():
+            listener.stop()
+
+    def restart_background_threads(self):
+        for logger, listener in list(self.log_listeners.items()):
+            self.start_log_listener(logger, listener.handlers)
+        self.init_log_buffers()
+        self.init_changelog_writer()
+        self.init_session_governor()
+        self.init_device_connection_pool()
+
     def init_redis(self):
         host = getenv("REDIS_ADDR")
         if not host:
@@ -208,18 +524,183 @@ class Environment:
             if vs.settings["redis"]["flush_on_restart"]:
                 self.redis_queue.flushdb()
 
+    def init_device_connection_pool(self):
+        self.connection_pool = OrderedDict()
+        self.connection_pool_lock = Lock()
+        self.pooled_connection_keys = {}
+        if vs.settings["automation"]["connection_pool"]["active"]:
+            Thread(target=self.connection_pool_reaper, daemon=True).start()
+
+    def init_session_governor(self):
+        self.governor = vs.settings["automation"]["governor"]
+        self.governed_sessions = {}
+        self.session_condition = Condition()
+        self.session_counts = defaultdict(int)
+        self.session_queues = defaultdict(deque)
+        if self.governor["active"] and self.redis_queue:
+            Thread(target=self.session_lease_renewer, daemon=True).start()
+
+    def init_target_cache(self):
+        self.target_cache = {}
+        self.target_cache_lock = Lock()
+        self.target_cache_version = 0
+
     def init_vault_client(self):
         url = getenv("VAULT_ADDR", "http://127.0.0.1:8200")
         self.vault_client = VaultClient(url=url, token=getenv("VAULT_TOKEN"))
         if self.vault_client.sys.is_sealed() and vs.settings["vault"]["unseal_vault"]:
             keys = [getenv(f"UNSEAL_VAULT_KEY{index}") for index in range(1, 6)]
             self.vault_client.sys.submit_unseal_keys(filter(None, keys))
+        self.vault_cache, self.vault_cache_lock = OrderedDict(), Lock()
+        self.vault_cache_generation, self.vault_cache_version = 0, None
+        self.vault_cache_next_check = 0
+
+    @staticmethod
+    def encode_bitmap(ids):
+        bitmap = bytearray(max(ids, default=0) // 8 + 1)
+        for id in ids:
+            bitmap[id >> 3] |= 1 << (id & 7)
+        return bitmap.hex()
+
+    @staticmethod
+    def decode_bitmap(value):
+        return frozenset(
+            index * 8 + bit
+            for index, byte in enumerate(bytes.fromhex(value))
+            if byte
+            for bit in range(8)
+            if byte >> bit & 1
+        )
+
+    def get_target_cache_version(self):
+        if not self.redis_queue:
+            return self.target_cache_version, 0
+        redis_version = self.redis("get", "rbac/targets/version") or 0
+        return self.target_cache_version, int(redis_version)
+
+    def invalidate_target_cache(self):
+        with self.target_cache_lock:
+            self.target_cache.clear()
+            self.target_cache_version += 1
+        if self.redis_queue:
+            self.redis("incr", "rbac/targets/version")
+
+    def get_allowed_targets(self, username, compute):
+        settings = vs.rbac["advanced"]["target_cache"]
+        if not settings["active"]:
+            return compute()
+        version = self.get_target_cache_version()
+        with self.target_cache_lock:
+            cached_version, expiry, targets = self.target_cache.get(
+                username, (None, 0, None)
+            )
+        if cached_version == version and (self.redis_queue or expiry > time()):
+            return targets
+        key = f"rbac/targets/{version[1]}/{username}"
+        bitmap = self.redis("get", key) if self.redis_queue else None
+        if bitmap:
+            targets = None if bitmap == "*" else self.decode_bitmap(bitmap)
+        else:
+            targets = compute()
+            if self.redis_queue:
+                bitmap = "*" if targets is None else self.encode_bitmap(targets)
+                self.redis("set", key, bitmap, ex=settings["ttl"])
+        with self.target_cache_lock:
+            expiry = time() + settings["local_ttl"]
+            self.target_cache[username] = (version, expiry, targets)
+        return targets
+
+    @staticmethod
+    def get_vault_path(instance, property):
+        return f"secret/data/{instance.type}/{instance.name}/{property}"
+
+    def drop_vault_secrets(self, paths):
+        for path in paths:
+            for cached_path in list(self.vault_cache):
+                if cached_path == path or cached_path.startswith(f"{path}/"):
+                    del self.vault_cache[cached_path]
+        self.vault_cache_generation += 1
+
+    def sync_vault_cache(self):
+        settings = vs.settings["vault"]["cache"]
+        if not self.redis_queue or time() < self.vault_cache_next_check:
+            return
+        self.vault_cache_next_check = time() + settings["version_check_interval"]
+        known_version = self.vault_cache_version
+        response = self.redis(
+            "eval",
+            SYNC_VAULT_CACHE_SCRIPT,
+            2,
+            "vault/cache/version",
+            "vault/cache/invalidations",
+            -1 if known_version is None else known_version,
+        )
+        if not response or response[0] == known_version:
+            return
+        version, flush, *paths = response
+        with self.vault_cache_lock:
+            if flush:
+                self.vault_cache.clear()
+                self.vault_cache_generation += 1
+            else:
+                self.drop_vault_secrets(paths)
+            self.vault_cache_version = version
+
+    def read_vault_secret(self, path):
+        settings = vs.settings["vault"]["cache"]
+        if not settings["active"]:
+            return self.vault_client.read(path)
+        self.sync_vault_cache()
+        with self.vault_cache_lock:
+            expiry, data = self.vault_cache.get(path, (0, None))
+            if expiry > time():
+                self.vault_cache.move_to_end(path)
+                return data
+            generation = self.vault_cache_generation
+        data = self.vault_client.read(path)
+        with self.vault_cache_lock:
+            if generation != self.vault_cache_generation:
+                return data
+            self.vault_cache[path] = (time() + settings["ttl"], data)
+            self.vault_cache.move_to_end(path)
+            while len(self.vault_cache) > settings["max_size"]:
+                self.vault_cache.popitem(last=False)
+        return data
+
+    def prefetch_vault_secrets(self, paths):
+        settings = vs.settings["vault"]["cache"]
+        if not settings["active"] or not paths:
+            return
+        with ThreadPoolExecutor(settings["prefetch_threads"]) as executor:
+            list(executor.map(self.read_vault_secret, paths))
+
+    def write_vault_secret(self, path, data):
+        self.vault_client.write(path, data=data)
+        self.invalidate_vault_secret(path)
+
+    def delete_vault_secret(self, path):
+        self.vault_client.delete(path)
+        self.invalidate_vault_secret(path)
+
+    def invalidate_vault_secret(self, path):
+        with self.vault_cache_lock:
+            self.drop_vault_secrets([path])
+        if self.redis_queue:
+            self.redis(
+                "eval",
+                INVALIDATE_VAULT_SECRET_SCRIPT,
+                2,
+                "vault/cache/version",
+                "vault/cache/invalidations",
+                path,
+                vs.settings["vault"]["cache"]["max_invalidations"],
+            )
 
     def get_workers(self):
         if not self.redis_queue:
             return {"error": "This endpoint requires the use of a Redis queue."}
         workers = defaultdict(lambda: {"jobs": {}, "info": {}})
-        keys = env.redis("keys", "workers/*")
+        keys = self.redis_keys("workers/*")
         if not keys:
             return {"error": "No data available in the Redis queue."}
         data = dict(zip(keys, env.redis("mget", *keys)))
@@ -234,34 +715,114 @@ class Environment:
         if not self.redis_queue:
             return
         key = f"workers/{getpid()}"
-        self.redis("set", f"{key}/info/memory", f"{Process().memory_percent()}%")
-        self.redis(mode, f"{key}/jobs/{job}", 1)
+        self.redis_pipeline(
+            ("set", f"{key}/info/memory", f"{Process().memory_percent()}%"),
+            (mode, f"{key}/jobs/{job}", 1),
+        )
 
     def log(self, severity, content, user=None, change_log=True, logger="root"):
         logger_settings = vs.logging["loggers"].get(logger, {})
         if logger:
             getattr(getLogger(logger), severity)(content)
         if change_log or logger and logger_settings.get("change_log"):
-            db.factory(
-                "changelog",
-                **{
-                    "severity": severity,
-                    "content": content,
-                    "user": user or getattr(current_user, "name", ""),
-                },
+            self.write_changelog(
+                severity=severity,
+                content=content,
+                user=user or getattr(current_user, "name", ""),
             )
         return logger_settings
 
+    def write_changelog(self, **kwargs):
+        settings = self.changelog_settings
+        if settings["active"]:
+            row = {"type": "changelog", "time": vs.get_time(), **kwargs}
+            try:
+                return self.changelog_queue.put(row, timeout=settings["put_timeout"])
+            except Full:
+                if settings["overflow"] == "drop":
+                    return self.count_changelog_rows("dropped", 1)
+                self.count_changelog_rows("synchronous", 1)
+        db.factory("changelog", **kwargs)
+
+    def changelog_writer(self):
+        settings = self.changelog_settings
+        while True:
+            row = self.changelog_queue.get()
+            if row is None:
+                return
+            rows, stop, deadline = [row], False, time() + settings["flush_interval"]
+            while len(rows) < settings["batch_size"]:
+                try:
+                    row = self.changelog_queue.get(timeout=max(deadline - time(), 0))
+                except Empty:
+                    break
+                if row is None:
+                    stop = True
+                    break
+                rows.append(row)
+            self.flush_changelog(rows)
+            if stop:
+                return
+
+    def stop_changelog_writer(self):
+        timeout = self.changelog_settings["shutdown_timeout"]
+        try:
+            self.changelog_queue.put(None, timeout=timeout)
+        except Full:
+            return error("Changelog writer could not be stopped (queue full)")
+        self.changelog_thread.join(timeout)
+        if self.changelog_thread.is_alive():
+            return error(f"Changelog writer still running after {timeout} seconds")
+        self.flush_changelog()
+
+    def flush_changelog(self, rows=None):
+        if rows is None:
+            rows = []
+            while True:
+                try:
+                    rows.append(self.changelog_queue.get_nowait())
+                except Empty:
+                    break
+        if not rows:
+            return
+        try:
+            db.bulk_insert("changelog", rows, commit=True)
+            self.count_changelog_rows("written", len(rows))
+        except Exception:
+            error(
+                f"Changelog writer failed to insert {len(rows)} rows:\n{format_exc()}"
+            )
+            self.count_changelog_rows("dropped", len(rows))
+
+    def count_changelog_rows(self, metric, number):
+        with self.changelog_lock:
+            self.changelog_metrics[metric] += number
+        if self.redis_queue:
+            self.redis("hincrby", "changelog/metrics", metric, number)
+
+    def get_changelog_metrics(self):
+        with self.changelog_lock:
+            metrics = dict(self.changelog_metrics)
+        return {"queue_depth": self.changelog_queue.qsize(), **metrics}
+
     def log_queue(self, runtime, service, log=None, mode="add", start_line=0):
         if self.redis_queue:
             key = f"{runtime}/{service}/logs"
             vs.run_logs[runtime][int(service)] = None
             if mode == "add":
-                log = self.redis("lpush", key, log)
+                if self.log_pipeline["run_log_buffer_size"] <= 1:
+                    return self.redis("rpush", key, log)
+                with self.log_buffer_lock:
+                    self.log_buffers[key].append(log)
+                    full = (
+                        len(self.log_buffers[key])
+                        >= self.log_pipeline["run_log_buffer_size"]
+                    )
+                if full:
+                    self.flush_log_buffers(key)
             else:
-                log = self.redis("lrange", key, 0, -1)
-                if log:
-                    log = log[::-1][start_line:]
+                self.flush_log_buffers(key)
+                log = self.redis("lrange", key, start_line, -1)
         else:
             if mode == "add":
                 return vs.run_logs[runtime][int(service)].append(log)
@@ -270,12 +831,50 @@ class Environment:
                 log = full_log[start_line:]
         return log
 
+    def flush_log_buffers(self, *keys):
+        with self.log_flush_lock:
+            with self.log_buffer_lock:
+                if keys:
+                    buffers = {
+                        key: self.log_buffers.pop(key)
+                        for key in keys
+                        if key in self.log_buffers
+                    }
+                else:
+                    buffers, self.log_buffers = self.log_buffers, defaultdict(list)
+            self.redis_pipeline(
+                *(("rpush", key, *logs) for key, logs in buffers.items())
+            )
+
+    def log_buffer_flusher(self):
+        while True:
+            sleep(self.log_pipeline["run_log_flush_interval"])
+            self.flush_log_buffers()
+
     def redis(self, operation, *args, **kwargs):
         try:
             return getattr(self.redis_queue, operation)(*args, **kwargs)
         except (ConnectionError, TimeoutError) as exc:
             self.log("error", f"Redis Queue Unreachable ({exc})", change_log=False)
 
+    def redis_keys(self, pattern):
+        try:
+            return list(self.redis_queue.scan_iter(match=pattern, count=1000))
+        except (ConnectionError, TimeoutError) as exc:
+            self.log("error", f"Redis Queue Unreachable ({exc})", change_log=False)
+            return []
+
+    def redis_pipeline(self, *commands):
+        if not commands:
+            return []
+        try:
+            pipeline = self.redis_queue.pipeline(transaction=False)
+            for operation, *args in commands:
+                getattr(pipeline, operation)(*args)
+            return pipeline.execute()
+        except (ConnectionError, TimeoutError) as exc:
+            self.log("error", f"Redis Queue Unreachable ({exc})", change_log=False)
+
     def send_email(
         self,
         subject,
@@ -150,6 +150,7 @@ class FormFactory:
         self.generate_instance_insertion_forms()
         self.generate_service_forms()
         self.generate_access_form()
+        db.configure_private_properties()
 
     def generate_filtering_forms(self):
         for model, properties in vs.properties["filtering"].items():
@@ -731,6 +732,14 @@ class ServiceForm(BaseForm):
     )
     multiprocessing = BooleanField("Multiprocessing")
     max_processes = IntegerField("Maximum number of processes", default=15)
+    multiprocessing_mode = SelectField(
+        "Multiprocessing Mode",
+        choices=(
+            ("thread", "Thread Pool"),
+            ("process", "Process Pool"),
+            ("asyncio", "Event Loop (Scrapli Services)"),
+        ),
+    )
     validation_condition = SelectField(
         choices=(
             ("none", "No validation"),
@@ -808,13 +817,24 @@ class ServiceForm(BaseForm):
                 f"The validation method is set to '{self.validation_method.data}'"
                 f" and the matching value is empty: these do no match."
             )
-        too_many_threads_error = (
-            self.max_processes.data > vs.settings["automation"]["max_process"]
+        event_loop_mode = self.multiprocessing_mode.data == "asyncio"
+        event_loop_error = event_loop_mode and not hasattr(
+            vs.models.get(self.form_type.data), "async_job"
         )
+        if event_loop_error:
+            self.multiprocessing_mode.errors.append(
+                "The 'Event Loop' multiprocessing mode is only available for"
+                " services that support it (Scrapli services)."
+            )
+        if event_loop_mode and not event_loop_error:
+            max_process = vs.settings["automation"]["event_loop"]["max_sessions"]
+        else:
+            max_process = vs.settings["automation"]["max_process"]
+        too_many_threads_error = self.max_processes.data > max_process
         if too_many_threads_error:
             self.max_processes.errors.append(
                 "The number of threads used for multiprocessing must be "
-                f"less than {vs.settings['automation']['max_process']}."
+                f"less than {max_process}."
             )
         shared_service_error = not self.shared.data and len(self.workflows.data) > 1
         if shared_service_error:
@@ -826,6 +846,7 @@ class ServiceForm(BaseForm):
             valid_form
             and not conversion_validation_mismatch
             and not empty_validation
+            and not event_loop_error
             and not forbidden_name_error
             and not no_recipient_error
             and not shared_service_error
@@ -949,6 +970,7 @@ class ConnectionForm(ServiceForm):
     start_new_connection = BooleanField("Start New Connection")
     connection_name = StringField("Connection Name", default="default")
     close_connection = BooleanField("Close Connection")
+    disable_connection_pool = BooleanField("Do not use the Connection Pool")
     groups = {
         "Connection Parameters": {
             "commands": [
@@ -958,6 +980,7 @@ class ConnectionForm(ServiceForm):
                 "start_new_connection",
                 "connection_name",
                 "close_connection",
+                "disable_connection_pool",
             ],
             "default": "expanded",
         }
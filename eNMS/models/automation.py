@@ -3,7 +3,7 @@ from flask_login import current_user
 from functools import wraps
 from requests import get, post
 from requests.exceptions import ConnectionError, MissingSchema, ReadTimeout
-from sqlalchemy import Boolean, case, ForeignKey, Integer
+from sqlalchemy import Boolean, case, ForeignKey, Index, Integer, UniqueConstraint
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import aliased, deferred, relationship
@@ -106,6 +106,7 @@ class Service(AbstractBase):
     maximum_runs = db.Column(Integer, default=1)
     multiprocessing = db.Column(Boolean, default=False)
     max_processes = db.Column(Integer, default=5)
+    multiprocessing_mode = db.Column(db.TinyString, default="thread")
     status = db.Column(db.TinyString, default="Idle")
     validation_condition = db.Column(db.TinyString, default="none")
     conversion_method = db.Column(db.TinyString, default="none")
@@ -232,6 +233,7 @@ class ConnectionService(Service):
     start_new_connection = db.Column(Boolean, default=False)
     connection_name = db.Column(db.SmallString, default="default")
     close_connection = db.Column(Boolean, default=False)
+    disable_connection_pool = db.Column(Boolean, default=False)
     __mapper_args__ = {"polymorphic_identity": "connection_service"}
 
 
@@ -245,7 +247,8 @@ class Result(AbstractBase):
     labels = db.Column(db.LargeString)
     runtime = db.Column(db.TinyString)
     duration = db.Column(db.TinyString)
-    result = deferred(db.Column(db.Dict))
+    result = deferred(db.Column(db.EncodedDict))
+    blob = db.Column(db.TinyString, index=True)
     creator = db.Column(db.SmallString)
     run_id = db.Column(Integer, ForeignKey("run.id", ondelete="cascade"))
     run = relationship("Run", back_populates="results", foreign_keys="Result.run_id")
@@ -271,6 +274,12 @@ class Result(AbstractBase):
     workflow_name = association_proxy(
         "workflow", "scoped_name", info={"name": "workflow_name"}
     )
+    __table_args__ = (
+        Index(
+            "ix_result_runtime_service_device", parent_runtime, service_id, device_id
+        ),
+        Index("ix_result_service_runtime", service_id, parent_runtime),
+    )
 
     def __getitem__(self, key):
         return self.result[key]
@@ -294,6 +303,29 @@ class Result(AbstractBase):
         return constraints
 
 
+class RunSummary(AbstractBase):
+
+    __tablename__ = type = "run_summary"
+    private = True
+    log_change = False
+    id = db.Column(Integer, primary_key=True)
+    parent_runtime = db.Column(db.TinyString)
+    min_runtime = db.Column(db.TinyString)
+    creator = db.Column(db.SmallString)
+    success_count = db.Column(Integer, default=0)
+    failure_count = db.Column(Integer, default=0)
+    run_id = db.Column(Integer, ForeignKey("run.id", ondelete="cascade"))
+    run = relationship(
+        "Run", back_populates="summaries", foreign_keys="RunSummary.run_id"
+    )
+    service_id = db.Column(Integer, ForeignKey("service.id", ondelete="cascade"))
+    service = relationship("Service", foreign_keys="RunSummary.service_id")
+    __table_args__ = (UniqueConstraint(parent_runtime, service_id),)
+
+    def __repr__(self):
+        return f"SUMMARY '{self.service}' ({self.parent_runtime})"
+
+
 class ServiceLog(AbstractBase):
 
     __tablename__ = type = "service_log"
@@ -323,7 +355,8 @@ class Run(AbstractBase):
     creator = db.Column(db.SmallString, default="")
     server = db.Column(db.SmallString)
     properties = db.Column(db.Dict)
-    payload = deferred(db.Column(db.Dict))
+    payload = deferred(db.Column(db.EncodedDict))
+    payload_blob = db.Column(db.TinyString, index=True)
     success = db.Column(Boolean, default=False)
     labels = db.Column(db.LargeString)
     status = db.Column(db.TinyString, default="Running")
@@ -349,7 +382,11 @@ class Run(AbstractBase):
     task = relationship("Task", foreign_keys="Run.task_id")
     state = db.Column(db.Dict, info={"log_change": False})
     results = relationship("Result", back_populates="run", cascade="all, delete-orphan")
+    summaries = relationship(
+        "RunSummary", back_populates="run", cascade="all, delete-orphan"
+    )
     model_properties = {"progress": "str", "service_properties": "dict"}
+    __table_args__ = (Index("ix_run_service_runtime", service_id, runtime),)
 
     def __init__(self, **kwargs):
         self.runtime = kwargs.get("runtime") or vs.get_time()
@@ -389,12 +426,9 @@ class Run(AbstractBase):
         if self.state:
             return self.state
         elif env.redis_queue:
-            keys = env.redis("keys", f"{self.runtime}/state/*")
-            if not keys:
-                return {}
-            data, state = list(zip(keys, env.redis("mget", *keys))), {}
-            for log, value in data:
-                inner_store, (*path, last_key) = state, log.split("/")[2:]
+            data, state = env.redis("hgetall", f"{self.runtime}/state") or {}, {}
+            for field, value in data.items():
+                inner_store, (*path, last_key) = state, field.split("/")
                 for key in path:
                     inner_store = inner_store.setdefault(key, {})
                 if value in ("False", "True"):
@@ -417,14 +451,22 @@ class Run(AbstractBase):
         except (KeyError, TypeError):
             return "N/A"
 
-    def run(self):
-        env.update_worker_job(self.service.name)
-        vs.run_targets[self.runtime] = set(
+    def compute_allowed_targets(self):
+        user = db.fetch("user", allow_none=True, name=self.creator, rbac=None)
+        if getattr(user, "is_admin", False):
+            return
+        return frozenset(
             device.id
             for device in controller.filtering(
                 "device", properties=["id"], rbac="target", username=self.creator
             )
         )
+
+    def run(self):
+        env.update_worker_job(self.service.name)
+        vs.run_targets[self.runtime] = env.get_allowed_targets(
+            self.creator, self.compute_allowed_targets
+        )
         if not self.trigger:
             run_type = "Parameterized" if self.parameterized_run else "Regular"
             self.trigger = f"{run_type} Run"
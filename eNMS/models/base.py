@@ -1,9 +1,39 @@
+from sqlalchemy import Boolean, Float, inspect, Integer, String
 from sqlalchemy.ext.mutable import MutableDict, MutableList
+from sqlalchemy.orm.attributes import InstrumentedAttribute
 
 from eNMS.database import db
 from eNMS.environment import env
 from eNMS.variables import vs
 
+SCALAR_TYPES = (Boolean, Float, Integer, String)
+
+
+class PrivateAttribute(InstrumentedAttribute):
+
+    __slots__ = ()
+
+    def __set__(self, instance, value):
+        if not value:
+            return
+        value = env.encrypt_password(value).decode("utf-8")
+        if env.use_vault:
+            path = env.get_vault_path(instance, self.key)
+            env.write_vault_secret(path, {self.key: value})
+        else:
+            super().__set__(instance, value)
+
+
+class VaultAttribute(PrivateAttribute):
+
+    __slots__ = ()
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return super().__get__(instance, owner)
+        data = env.read_vault_secret(env.get_vault_path(instance, self.key))
+        return data["data"]["data"][self.key] if data else ""
+
 
 class AbstractBase(db.base):
 
@@ -20,33 +50,13 @@ class AbstractBase(db.base):
     def __repr__(self):
         return str(getattr(self, "name", self.id))
 
-    def __getattribute__(self, property):
-        if property in vs.private_properties_set:
-            if env.use_vault:
-                target = self.service if self.type == "run" else self
-                path = f"secret/data/{target.type}/{target.name}/{property}"
-                data = env.vault_client.read(path)
-                value = data["data"]["data"][property] if data else ""
-            else:
-                value = super().__getattribute__(property)
-            return value
-        else:
-            return super().__getattribute__(property)
-
-    def __setattr__(self, property, value):
-        if property in vs.private_properties_set:
-            if not value:
-                return
-            value = env.encrypt_password(value).decode("utf-8")
-            if env.use_vault:
-                env.vault_client.write(
-                    f"secret/data/{self.type}/{self.name}/{property}",
-                    data={property: value},
-                )
-            else:
-                super().__setattr__(property, value)
-        else:
-            super().__setattr__(property, value)
+    @classmethod
+    def configure_private_properties(cls):
+        attribute_class = VaultAttribute if env.use_vault else PrivateAttribute
+        for property in vs.private_properties_set:
+            attribute = vars(cls).get(property)
+            if isinstance(attribute, InstrumentedAttribute):
+                attribute.__class__ = attribute_class
 
     @classmethod
     def filtering_constraints(cls, **_):
@@ -97,16 +107,26 @@ class AbstractBase(db.base):
     def delete(self):
         pass
 
-    def get_properties(
-        self, export=False, exclude=None, include=None, private_properties=False
-    ):
-        result = {}
+    @staticmethod
+    def convert_mutable(value):
+        if isinstance(value, MutableList):
+            return list(value)
+        if isinstance(value, MutableDict):
+            return dict(value)
+        return value
+
+    def get_serialization_plan(self, export, private_properties, include, exclude):
+        key = (self.type, export, private_properties, include, exclude)
+        plan = db.serialization_plans.get(key)
+        if plan is not None:
+            return plan
         no_migrate = db.dont_migrate.get(getattr(self, "export_type", self.type), {})
-        properties = list(vs.model_properties[self.type])
-        for property in properties:
+        dont_serialize = db.dont_serialize.get(self.type, [])
+        columns, plan = inspect(type(self)).columns, []
+        for property in vs.model_properties[self.type]:
             if not private_properties and property in vs.private_properties_set:
                 continue
-            if property in db.dont_serialize.get(self.type, []):
+            if property in dont_serialize:
                 continue
             if export and property in getattr(self, "model_properties", {}):
                 continue
@@ -114,17 +134,41 @@ class AbstractBase(db.base):
                 continue
             if export and property in no_migrate:
                 continue
+            column = columns.get(property)
+            scalar = isinstance(getattr(column, "type", None), SCALAR_TYPES)
+            plan.append((property, None if scalar else self.convert_mutable))
+        relations = tuple(
+            (property, relation["list"])
+            for property, relation in vs.relationships[self.type].items()
+            if not (include and property not in include)
+            and not (exclude and property in exclude)
+            and not (export and property in no_migrate)
+        )
+        if len(db.serialization_plans) >= db.queries["serialization_plan_cache_size"]:
+            db.serialization_plans.clear()
+        plan = db.serialization_plans[key] = (tuple(plan), relations)
+        return plan
+
+    def get_properties(
+        self, export=False, exclude=None, include=None, private_properties=False
+    ):
+        result = {}
+        plan, _ = self.get_serialization_plan(
+            export,
+            private_properties,
+            frozenset(include or ()),
+            frozenset(exclude or ()),
+        )
+        for property, converter in plan:
             try:
                 value = getattr(self, property)
             except AttributeError:
                 continue
             if export:
-                if isinstance(value, MutableList):
-                    value = list(value)
-                if isinstance(value, MutableDict):
-                    value = dict(value)
                 if value is None:
                     continue
+                if converter:
+                    value = converter(value)
             result[property] = value
         return result
 
@@ -159,27 +203,25 @@ class AbstractBase(db.base):
         properties = self.get_properties(
             export, exclude=exclude, private_properties=private_properties
         )
-        no_migrate = db.dont_migrate.get(getattr(self, "export_type", self.type), {})
-        for property, relation in vs.relationships[self.type].items():
-            if include and property not in include or exclude and property in exclude:
-                continue
-            if export and property in no_migrate:
-                continue
+        _, relations = self.get_serialization_plan(
+            export,
+            private_properties,
+            frozenset(include or ()),
+            frozenset(exclude or ()),
+        )
+        names_only = export or relation_names_only
+        for property, is_list in relations:
             value = getattr(self, property)
-            if relation["list"]:
+            if is_list:
                 properties[property] = [
-                    obj.name
-                    if export or relation_names_only
-                    else obj.get_properties(exclude=exclude)
+                    obj.name if names_only else obj.get_properties(exclude=exclude)
                     for obj in value
                 ]
             else:
                 if not value:
                     continue
                 properties[property] = (
-                    value.name
-                    if export or relation_names_only
-                    else value.get_properties(exclude=exclude)
+                    value.name if names_only else value.get_properties(exclude=exclude)
                 )
         return properties
 
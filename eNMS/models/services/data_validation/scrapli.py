@@ -26,27 +26,38 @@ class ScrapliService(ConnectionService):
 
     __mapper_args__ = {"polymorphic_identity": "scrapli_service"}
 
-    def job(self, run, device):
+    def get_commands(self, run, device):
         if self.jinja2_template:
             variables = {**locals(), **run.global_variables()}
             commands = Template(run.commands).render(variables)
         else:
             commands = run.sub(run.commands, locals())
         commands = commands.splitlines()
-        function = "send_configs" if run.is_configuration else "send_commands"
         run.log(
             "info",
             f"sending COMMANDS {commands} with Scrapli",
             device,
             logger="security",
         )
+        return commands
+
+    def get_result(self, multi_response):
+        if self.results_as_list:
+            return [response.result for response in multi_response]
+        return multi_response.result
+
+    def job(self, run, device):
+        commands = self.get_commands(run, device)
+        function = "send_configs" if run.is_configuration else "send_commands"
         multi_response = getattr(run.scrapli_connection(device), function)(commands)
-        result = (
-            [resp.result for resp in multi_response]
-            if self.results_as_list
-            else multi_response.result
-        )
-        return {"commands": commands, "result": result}
+        return {"commands": commands, "result": self.get_result(multi_response)}
+
+    async def async_job(self, run, device):
+        commands = self.get_commands(run, device)
+        function = "send_configs" if run.is_configuration else "send_commands"
+        async with run.async_scrapli_connection(device) as connection:
+            multi_response = await getattr(connection, function)(commands)
+        return {"commands": commands, "result": self.get_result(multi_response)}
 
 
 class ScrapliCommandsForm(ScrapliForm):
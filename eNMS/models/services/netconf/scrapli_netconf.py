@@ -21,7 +21,7 @@ class ScrapliNetconfService(ConnectionService):
 
     __mapper_args__ = {"polymorphic_identity": "scrapli_netconf_service"}
 
-    def job(self, run, device):
+    def get_arguments(self, run, device):
         content, kwargs = run.sub(run.content, locals()), {}
         if "lock" in run.command or "config" in run.command:
             parameter = "source" if run.command == "get_config" else "target"
@@ -31,11 +31,23 @@ class ScrapliNetconfService(ConnectionService):
             kwargs[parameter] = content
         if run.command == "get":
             kwargs["filter_type"] = "subtree"
+        return kwargs
+
+    def job(self, run, device):
+        kwargs = self.get_arguments(run, device)
         response = getattr(run.scrapli_connection(device), run.command)(**kwargs)
         if run.commit_config:
             run.scrapli_connection(device).commit()
         return {"filter_": filter, "kwargs": kwargs, "result": response.result}
 
+    async def async_job(self, run, device):
+        kwargs = self.get_arguments(run, device)
+        async with run.async_scrapli_connection(device) as connection:
+            response = await getattr(connection, run.command)(**kwargs)
+            if run.commit_config:
+                await connection.commit()
+        return {"filter_": filter, "kwargs": kwargs, "result": response.result}
+
 
 class ScrapliNetconfForm(ConnectionForm):
     form_type = HiddenField(default="scrapli_netconf_service")
@@ -35,7 +35,7 @@ class PythonSnippetService(Service):
         globals = {
             "results": results,
             "save_result": save_result,
-            **run.global_variables(**locals()),
+            **run.exec_variables(**locals()),
         }
 
         try:
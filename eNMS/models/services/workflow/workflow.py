@@ -1,8 +1,10 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from heapq import heappop, heappush
-from sqlalchemy import Boolean, ForeignKey, Integer
+from sqlalchemy import Boolean, event, ForeignKey, Integer
 from sqlalchemy.orm import aliased, backref, relationship
 from sqlalchemy.schema import UniqueConstraint
+from threading import Lock
 
 from eNMS.database import db
 from eNMS.models.base import AbstractBase
@@ -31,6 +33,7 @@ class Workflow(Service):
     man_minutes_type = db.Column(db.TinyString, default="device")
     man_minutes = db.Column(Integer, default=0)
     man_minutes_total = db.Column(Integer, default=0)
+    parallel_services = db.Column(Integer, default=1)
     services = relationship(
         "Service", secondary=db.service_workflow_table, back_populates="workflows"
     )
@@ -45,6 +48,14 @@ class Workflow(Service):
     )
 
     __mapper_args__ = {"polymorphic_identity": "workflow"}
+    parallel_relations = {
+        "parent_device": "device",
+        "restart_run": "run",
+        "service": "service",
+        "workflow": "workflow",
+    }
+    plan_cache = OrderedDict()
+    plan_cache_lock = Lock()
 
     def __init__(self, **kwargs):
         migration_import = kwargs.get("migration_import", False)
@@ -124,10 +135,79 @@ class Workflow(Service):
         ]
         return sum(edges, [])
 
+    def get_execution_plan(self):
+        with self.plan_cache_lock:
+            last_modified, plan = self.plan_cache.get(self.id, (None, None))
+            if plan and last_modified == self.last_modified:
+                self.plan_cache.move_to_end(self.id)
+                return plan
+        edge, service = vs.models["workflow_edge"], vs.models["service"]
+        edges = db.session.query(
+            edge.id, edge.subtype, edge.source_id, edge.destination_id
+        ).filter(edge.workflow_id == self.id)
+        neighbors, sources = defaultdict(list), defaultdict(set)
+        for edge_id, subtype, source_id, destination_id in edges:
+            neighbors[(source_id, subtype)].append((edge_id, destination_id))
+            sources[destination_id].add(source_id)
+        ancestors = defaultdict(set)
+        for service_id in list(sources):
+            stack = list(sources[service_id])
+            while stack:
+                source_id = stack.pop()
+                if source_id not in ancestors[service_id]:
+                    ancestors[service_id].add(source_id)
+                    stack.extend(sources[source_id])
+        plan = {
+            "ancestors": dict(ancestors),
+            "neighbors": dict(neighbors),
+            **dict(
+                db.session.query(service.scoped_name, service.id).filter(
+                    service.scoped_name.in_(("Start", "End"))
+                )
+            ),
+        }
+        with self.plan_cache_lock:
+            self.plan_cache[self.id] = (self.last_modified, plan)
+            while len(self.plan_cache) > vs.automation["workflow"]["plan_cache_size"]:
+                self.plan_cache.popitem(last=False)
+        return plan
+
+    @staticmethod
+    def get_ready_service(pending, running, ancestors):
+        running_ids = {service.id for service in running.values()}
+        ready_services = []
+        for service_id, service in pending.items():
+            service_ancestors = ancestors.get(service_id, set())
+            if (service_ancestors | {service_id}) & running_ids:
+                continue
+            if (service_ancestors - {service_id}) & set(pending):
+                continue
+            ready_services.append(service)
+        if not ready_services and not running:
+            ready_services = list(pending.values())
+        return min(
+            ready_services, key=lambda service: 1 / service.priority, default=None
+        )
+
+    @classmethod
+    def run_parallel_service(cls, run, kwargs):
+        try:
+            for property, model in cls.parallel_relations.items():
+                if kwargs.get(property):
+                    kwargs[property] = db.fetch(model, id=kwargs[property], rbac=None)
+            if "target_devices" in kwargs:
+                names = kwargs["target_devices"]
+                kwargs["target_devices"] = db.fetch_in("device", "name", names)
+            results = Runner(run, payload=run.payload, **kwargs).results
+            db.session.commit()
+            return results
+        finally:
+            db.session.remove()
+
     def job(self, run, device=None):
-        number_of_runs = defaultdict(int)
-        start = db.fetch("service", scoped_name="Start")
-        end = db.fetch("service", scoped_name="End")
+        number_of_runs, plan = defaultdict(int), self.get_execution_plan()
+        start = db.session.get(vs.models["service"], plan["Start"])
+        end = db.session.get(vs.models["service"], plan["End"])
         services, targets = [], defaultdict(set)
         start_targets = [device] if device else run.target_devices
         for service_id in run.start_services or [start.id]:
@@ -136,63 +216,123 @@ class Workflow(Service):
             heappush(services, (1 / service.priority, service))
         visited, restart_run = set(), run.restart_run
         tracking_bfs = run.run_method == "per_service_with_workflow_targets"
-        while services:
-            if run.stop:
-                return {"payload": run.payload, "success": False, "result": "Aborted"}
-            _, service = heappop(services)
-            if number_of_runs[service.name] >= service.maximum_runs:
-                continue
-            number_of_runs[service.name] += 1
-            visited.add(service)
-            if service in (start, end) or service.skip.get(self.name, False):
-                success = service.skip_value == "success"
-                results = {"result": "skipped", "success": success}
-                if tracking_bfs or device:
-                    results["summary"] = {
-                        "success": targets[service.name],
-                        "failure": [],
-                    }
-            else:
-                kwargs = {
-                    "service": run.placeholder
-                    if service.scoped_name == "Placeholder"
-                    else service,
-                    "workflow": self,
-                    "restart_run": restart_run,
-                    "parent": run,
-                    "parent_runtime": run.parent_runtime,
-                    "workflow_run_method": run.run_method,
-                }
-                if tracking_bfs or device:
-                    kwargs["target_devices"] = [
-                        db.fetch("device", name=name) for name in targets[service.name]
-                    ]
-                if run.parent_device:
-                    kwargs["parent_device"] = run.parent_device
-                results = Runner(run, payload=run.payload, **kwargs).results
-                if not results:
-                    continue
+        track_targets = bool(tracking_bfs or device)
+        parallel_run = self.parallel_services > 1
+
+        def get_skip_results(service):
+            if service not in (start, end) and not service.skip.get(self.name, False):
+                return
+            success = service.skip_value == "success"
+            results = {"result": "skipped", "success": success}
+            if track_targets:
+                results["summary"] = {"success": targets[service.name], "failure": []}
+            return results
+
+        def get_runner_kwargs(service):
+            is_placeholder = service.scoped_name == "Placeholder"
+            kwargs = {
+                "service": run.placeholder if is_placeholder else service,
+                "workflow": self,
+                "restart_run": restart_run,
+                "parent": run,
+                "parent_runtime": run.parent_runtime,
+                "workflow_run_method": run.run_method,
+            }
+            if track_targets:
+                kwargs["target_devices"] = list(targets[service.name])
+            if run.parent_device:
+                kwargs["parent_device"] = run.parent_device
+            if parallel_run:
+                for property in self.parallel_relations:
+                    if property in kwargs:
+                        kwargs[property] = getattr(kwargs[property], "id", None)
+            elif track_targets:
+                names = kwargs["target_devices"]
+                kwargs["target_devices"] = db.fetch_in("device", "name", names)
+            return kwargs
+
+        def process_results(service, results, schedule):
             status = "success" if results["success"] else "failure"
             summary = results.get("summary", {})
-            if not tracking_bfs and not device:
+            if not track_targets:
                 run.write_state(f"progress/service/{status}", 1, "increment")
             for edge_type in ("success", "failure"):
                 if not tracking_bfs and edge_type != status:
                     continue
-                if (tracking_bfs or device) and not summary[edge_type]:
+                if track_targets and not summary[edge_type]:
                     continue
-                for edge in service.neighbors(self, edge_type):
-                    successor = edge.destination
-                    if tracking_bfs or device:
+                neighbors = plan["neighbors"].get((service.id, edge_type), [])
+                for edge_id, successor_id in neighbors:
+                    successor = db.session.get(vs.models["service"], successor_id)
+                    if track_targets:
                         targets[successor.name] |= set(summary[edge_type])
-                    heappush(services, ((1 / successor.priority, successor)))
-                    if tracking_bfs or device:
                         run.write_state(
-                            f"edges/{edge.id}", len(summary[edge_type]), "increment"
+                            f"edges/{edge_id}", len(summary[edge_type]), "increment"
                         )
                     else:
-                        run.write_state(f"edges/{edge.id}", "DONE")
-        if tracking_bfs or device:
+                        run.write_state(f"edges/{edge_id}", "DONE")
+                    schedule(successor)
+
+        def start_service(service):
+            if number_of_runs[service.name] >= service.maximum_runs:
+                return False
+            number_of_runs[service.name] += 1
+            visited.add(service)
+            return True
+
+        aborted = {"payload": run.payload, "success": False, "result": "Aborted"}
+        if parallel_run:
+            pending = {service.id: service for _, service in sorted(services)}
+            ancestors, running = plan["ancestors"], {}
+
+            def schedule(successor):
+                pending.setdefault(successor.id, successor)
+
+            with ThreadPoolExecutor(max_workers=self.parallel_services) as executor:
+                while pending or running:
+                    if run.stop:
+                        wait(running)
+                        return aborted
+                    while len(running) < self.parallel_services:
+                        service = self.get_ready_service(pending, running, ancestors)
+                        if not service:
+                            break
+                        del pending[service.id]
+                        if not start_service(service):
+                            continue
+                        results = get_skip_results(service)
+                        if results:
+                            process_results(service, results, schedule)
+                            continue
+                        kwargs = get_runner_kwargs(service)
+                        future = executor.submit(self.run_parallel_service, run, kwargs)
+                        running[future] = service
+                    if not running:
+                        continue
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        service, results = running.pop(future), future.result()
+                        if results:
+                            process_results(service, results, schedule)
+        else:
+
+            def schedule(successor):
+                heappush(services, ((1 / successor.priority, successor)))
+
+            while services:
+                if run.stop:
+                    return aborted
+                _, service = heappop(services)
+                if not start_service(service):
+                    continue
+                results = get_skip_results(service)
+                if not results:
+                    kwargs = get_runner_kwargs(service)
+                    results = Runner(run, payload=run.payload, **kwargs).results
+                    if not results:
+                        continue
+                process_results(service, results, schedule)
+        if track_targets:
             failed = list(targets[start.name] - targets[end.name])
             summary = {"success": list(targets[end.name]), "failure": failed}
             results = {
@@ -201,6 +341,7 @@ class Workflow(Service):
                 "summary": summary,
             }
         else:
+            summary = {"success": [], "failure": []}
             results = {"payload": run.payload, "success": end in visited}
         run.restart_run = restart_run
         if run.is_main_run and self.man_minutes:
@@ -246,6 +387,9 @@ class WorkflowForm(ServiceForm):
     man_minutes_total = IntegerField(
         "Total Number of Minutes", default=0, render_kw={"readonly": True}
     )
+    parallel_services = IntegerField(
+        "Maximum number of services running in parallel", default=1
+    )
     superworkflow = InstanceField(
         "Superworkflow",
         constraints={"children": ["[Shared] Placeholder"], "children_filter": "union"},
@@ -274,8 +418,21 @@ class WorkflowForm(ServiceForm):
                     " with the 'Service Targets' Run Method."
                 )
             )
+        max_parallel_services = vs.settings["automation"]["max_parallel_services"]
+        invalid_parallel_services_error = not (
+            1 <= self.parallel_services.data <= max_parallel_services
+        )
+        if invalid_parallel_services_error:
+            self.parallel_services.errors.append(
+                "The number of services running in parallel must be between 1 "
+                f"and {max_parallel_services}."
+            )
         return valid_form and not any(
-            [invalid_man_minutes_type_error, invalid_man_minutes_error]
+            [
+                invalid_man_minutes_type_error,
+                invalid_man_minutes_error,
+                invalid_parallel_services_error,
+            ]
         )
 
 
@@ -318,6 +475,19 @@ class WorkflowEdge(AbstractBase):
         super().update(**kwargs)
         self.set_name(kwargs.get("name"))
 
+    @classmethod
+    def configure_events(cls):
+        for event_name in ("after_delete", "after_insert", "after_update"):
+
+            @event.listens_for(cls, event_name)
+            def update_workflow_timestamp(mapper, connection, target):
+                service_table = vs.models["service"].__table__
+                connection.execute(
+                    service_table.update()
+                    .where(service_table.c.id == target.workflow_id)
+                    .values(last_modified=vs.get_time())
+                )
+
     @classmethod
     def rbac_filter(cls, query, mode, user):
         if mode == "edit":
@@ -35,6 +35,7 @@ class RestApi:
     }
 
     allowed_endpoints = [
+        "backfill_run_summaries",
         "get_cluster_status",
         "get_git_content",
         "update_all_pools",
@@ -90,24 +91,26 @@ class RestApi:
         errors, devices, pools = [], [], []
         service = db.fetch("service", name=data.pop("name"), rbac="run")
         handle_asynchronously = data.get("async", True)
-        for device_name in data.get("devices", ""):
-            device = db.fetch("device", name=device_name)
-            if device:
-                devices.append(device.id)
-            else:
-                errors.append(f"No device with the name '{device_name}'")
-        for device_ip in data.get("ip_addresses", ""):
-            device = db.fetch("device", ip_address=device_ip)
-            if device:
-                devices.append(device.id)
-            else:
-                errors.append(f"No device with the IP address '{device_ip}'")
-        for pool_name in data.get("pools", ""):
-            pool = db.fetch("pool", name=pool_name)
-            if pool:
-                pools.append(pool.id)
-            else:
-                errors.append(f"No pool with the name '{pool_name}'")
+        targets = (
+            ("devices", "device", "name", "device with the name", devices),
+            (
+                "ip_addresses",
+                "device",
+                "ip_address",
+                "device with the IP address",
+                devices,
+            ),
+            ("pools", "pool", "name", "pool with the name", pools),
+        )
+        for key, model, property, label, instances in targets:
+            values, matches = data.get(key, ""), {}
+            for instance in db.fetch_in(model, property, set(values)):
+                matches.setdefault(getattr(instance, property), instance.id)
+            for value in values:
+                if value in matches:
+                    instances.append(matches[value])
+                else:
+                    errors.append(f"No {label} '{value}'")
         if errors:
             return {"errors": errors}
         if devices or pools:
@@ -1,32 +1,45 @@
+from asyncio import gather, get_running_loop, run as run_coroutine, Semaphore
+from asyncio import sleep as async_sleep
 from builtins import __dict__ as builtins
+from collections import Counter, defaultdict, OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from copy import deepcopy
 from datetime import datetime
 from functools import partial
+from hashlib import sha256
+from heapq import heappop, heappush
 from importlib import __import__ as importlib_import
 from io import BytesIO, StringIO
-from json import dump, load, loads
+from itertools import count
+from json import dump, dumps, load, loads
 from json.decoder import JSONDecodeError
-from multiprocessing.pool import ThreadPool
+from logging import getLevelName, getLogger
 from napalm import get_network_driver
 from ncclient import manager
 from netmiko import ConnectHandler
 from operator import attrgetter
 from os import getenv
 from paramiko import AutoAddPolicy, RSAKey, SFTPClient, SSHClient
-from re import compile, search
+from pickle import dumps as pickle_dumps
+from re import compile
 from requests import post
 from scp import SCPClient
-from threading import Thread
-from time import sleep
+from sqlalchemy import case, func, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+from sqlalchemy.sql.expression import true
+from threading import Lock, RLock, Thread
+from time import sleep, time
 from traceback import format_exc
-from types import GeneratorType
+from types import GeneratorType, MappingProxyType
 from warnings import warn
 from xmltodict import parse
 from xml.parsers.expat import ExpatError
 
 try:
-    from scrapli import Scrapli
-    from scrapli_netconf.driver import NetconfDriver
+    from scrapli import AsyncScrapli, Scrapli
+    from scrapli_netconf.driver import AsyncNetconfDriver, NetconfDriver
 except ImportError as exc:
     warn(f"Couldn't import scrapli module ({exc})")
 
@@ -40,11 +53,58 @@ from eNMS.environment import env
 from eNMS.variables import vs
 
 
+class ListMatch:
+    def __init__(self, items=()):
+        self.hashable_items, self.unhashable_items = Counter(), []
+        for item in items:
+            try:
+                self.hashable_items[item] += 1
+            except TypeError:
+                self.unhashable_items.append(item)
+
+    def __bool__(self):
+        return bool(self.hashable_items or self.unhashable_items)
+
+    def copy(self):
+        list_match = ListMatch()
+        list_match.hashable_items = self.hashable_items.copy()
+        list_match.unhashable_items = list(self.unhashable_items)
+        return list_match
+
+    def remove(self, item):
+        try:
+            number = self.hashable_items[item]
+        except TypeError:
+            try:
+                self.unhashable_items.remove(item)
+            except ValueError:
+                pass
+            return
+        if number > 1:
+            self.hashable_items[item] = number - 1
+        elif number:
+            del self.hashable_items[item]
+
+
 class Runner:
+
+    process_snapshot_relations = {
+        "parent_device": "device",
+        "restart_run": "run",
+        "service": "service",
+        "workflow": "workflow",
+    }
+    code_cache = OrderedDict()
+    code_cache_lock = Lock()
+    process_snapshot = None
+    runtime_lock = Lock()
+    substitution_regex = compile("{{(.*?)}}")
+
     def __init__(self, run, **kwargs):
         self.parameterized_run = False
         self.is_main_run = kwargs.pop("is_main_run", False)
         self.iteration_run = False
+        self.in_process_pool = False
         self.workflow = None
         self.workflow_run_method = None
         self.parent_device = None
@@ -52,9 +112,17 @@ class Runner:
         self.creator = self.run.creator
         self.start_services = []
         self.parent_runtime = kwargs.get("parent_runtime")
-        self.runtime = self.parent_runtime if self.is_main_run else vs.get_time()
+        self.runtime = self.parent_runtime if self.is_main_run else self.get_runtime()
         self.has_result = False
+        self.code_cache_metrics = {"hits": 0, "misses": 0}
+        self.static_validation, self.validation_matchers = None, {}
+        self.result_buffer, self.result_buffer_lock = [], Lock()
+        self.last_result_flush = time()
+        self.state_increments, self.state_lock = defaultdict(int), Lock()
+        self.last_state_flush = time()
         vs.run_instances[self.runtime] = self
+        if "payload_lock" not in kwargs:
+            kwargs["payload_lock"] = RLock() if self.is_main_run else run.payload_lock
         for key, value in kwargs.items():
             setattr(self, key, value)
         self.in_process = False if self.is_main_run else run.in_process
@@ -62,6 +130,7 @@ class Runner:
         self.progress_key = f"progress/{device_progress}"
         self.is_admin_run = db.fetch("user", name=self.creator).is_admin
         self.main_run = db.fetch("run", runtime=self.parent_runtime)
+        self.base_namespace = self.get_base_namespace()
         if not self.is_main_run:
             self.path = f"{run.path}>{self.service.id}"
         db.session.commit()
@@ -71,6 +140,14 @@ class Runner:
     def __repr__(self):
         return f"{self.runtime}: SERVICE '{self.service}'"
 
+    def get_runtime(self):
+        with self.runtime_lock:
+            runtime = vs.get_time()
+            while runtime in vs.run_instances:
+                runtime = vs.get_time()
+            vs.run_instances[runtime] = self
+        return runtime
+
     def __getattr__(self, key):
         if key in self.__dict__:
             return self.__dict__[key]
@@ -124,6 +201,7 @@ class Runner:
 
     @property
     def progress(self):
+        self.flush_state()
         progress = self.main_run.get_state().get(self.path, {}).get("progress")
         try:
             progress = progress["device"]
@@ -135,21 +213,21 @@ class Runner:
 
     def compute_devices_from_query(_self, query, property, **locals):  # noqa: N805
         values = _self.eval(query, **locals)[0]
-        devices, not_found = set(), []
+        devices, lookup_values = set(), []
         if isinstance(values, str):
             values = [values]
         for value in values:
             if isinstance(value, vs.models["device"]):
-                device = value
+                devices.add(value)
             else:
-                device = db.fetch("device", allow_none=True, **{property: value})
-            if device:
-                devices.add(device)
-            else:
-                not_found.append(value)
+                lookup_values.append(value)
+        matches = {}
+        for device in db.fetch_in("device", property, set(lookup_values)):
+            matches.setdefault(getattr(device, property), device)
+        not_found = [value for value in lookup_values if value not in matches]
         if not_found:
             raise Exception(f"Device query invalid targets: {', '.join(not_found)}")
-        return devices
+        return devices | set(matches.values())
 
     def compute_devices(self):
         devices = set(self.get_target_property("target_devices"))
@@ -166,10 +244,11 @@ class Runner:
             if self.update_target_pools:
                 pool.compute_pool()
             devices |= set(pool.devices)
+        allowed_targets = vs.run_targets[self.parent_runtime]
         restricted_devices = set(
             device
             for device in devices
-            if device.id not in vs.run_targets[self.parent_runtime]
+            if allowed_targets is not None and device.id not in allowed_targets
         )
         if restricted_devices:
             result = (
@@ -192,13 +271,18 @@ class Runner:
 
     def write_state(self, path, value, method=None):
         if env.redis_queue:
-            if isinstance(value, bool):
-                value = str(value)
-            env.redis(
-                {None: "set", "append": "lpush", "increment": "incr"}[method],
-                f"{self.parent_runtime}/state/{self.path}/{path}",
-                value,
-            )
+            field = f"{self.path}/{path}"
+            if method == "increment":
+                flush_interval = vs.settings["redis"]["state_flush_interval"]
+                with self.state_lock:
+                    self.state_increments[field] += value
+                    if time() - self.last_state_flush < flush_interval:
+                        return
+                self.flush_state()
+            else:
+                if isinstance(value, bool):
+                    value = str(value)
+                self.flush_state(("hset", f"{self.parent_runtime}/state", field, value))
         else:
             *keys, last = f"{self.parent_runtime}/{self.path}/{path}".split("/")
             store = vs.run_states
@@ -212,6 +296,18 @@ class Runner:
             else:
                 store.setdefault(last, []).append(value)
 
+    def flush_state(self, *commands):
+        if not env.redis_queue:
+            return
+        with self.state_lock:
+            increments, self.state_increments = self.state_increments, defaultdict(int)
+            self.last_state_flush = time()
+        key = f"{self.parent_runtime}/state"
+        env.redis_pipeline(
+            *(("hincrby", key, field, value) for field, value in increments.items()),
+            *commands,
+        )
+
     def start_run(self):
         self.init_state()
         self.write_state("status", "Running")
@@ -226,6 +322,7 @@ class Runner:
             results.update({"success": False, "result": result})
         finally:
             try:
+                self.flush_results()
                 db.session.commit()
             except Exception:
                 db.session.rollback()
@@ -245,6 +342,9 @@ class Runner:
             vs.service_run_count[self.service.id] -= 1
             if not vs.service_run_count[self.id]:
                 self.service.status = "Idle"
+            for metric, value in self.code_cache_metrics.items():
+                self.write_state(f"metrics/code_cache/{metric}", value, "increment")
+            self.flush_state()
             now = datetime.now().replace(microsecond=0)
             results["duration"] = str(now - start)
             if self.is_main_run:
@@ -264,38 +364,235 @@ class Runner:
             must_have_results = not self.has_result and not self.iteration_devices
             if self.is_main_run or len(self.target_devices) > 1 or must_have_results:
                 results = self.create_result(results, run_result=self.is_main_run)
+            if self.has_result:
+                self.update_run_summary()
+            if self.is_main_run:
+                vs.run_credentials.pop(self.parent_runtime, None)
             if env.redis_queue and self.is_main_run:
-                runtime_keys = env.redis("keys", f"{self.parent_runtime}/*") or []
-                env.redis("delete", *runtime_keys)
+                runtime_keys = env.redis_keys(f"{self.parent_runtime}/*")
+                if runtime_keys:
+                    env.redis("delete", *runtime_keys)
             vs.custom.run_post_processing(self, results)
 
         self.results = results
 
-    def make_json_compliant(self, input):
+    def log_conversions(self, converted_types):
+        if not converted_types:
+            return
+        conversions = ", ".join(
+            f"{number} {value_type}" for value_type, number in converted_types.items()
+        )
+        self.log("info", f"Converting to string: {conversions}")
+
+    def convert_values(self, input):
+        converted_types = Counter()
+
         def rec(value):
             if isinstance(value, dict):
-                return {key: rec(value[key]) for key in list(value)}
-            elif isinstance(value, list):
+                return {key: rec(item) for key, item in value.items()}
+            elif isinstance(value, (list, tuple)):
                 return list(map(rec, value))
-            elif not isinstance(value, (int, str, bool, float, None.__class__)):
-                self.log("info", f"Converting {value} to string")
-                return str(value)
-            else:
+            elif isinstance(value, (bool, float, int, str, type(None))):
                 return value
+            converted_types[type(value).__name__] += 1
+            return str(value)
+
+        try:
+            converted_input = rec(input)
+        except Exception:
+            log = f"Payload conversion to JSON failed:\n{format_exc()}"
+            self.log("error", log)
+            converted_input = {"error": log}
+        self.log_conversions(converted_types)
+        return converted_input
+
+    def encode(self, input, decode=False):
+        converted_types = Counter()
+
+        def convert(value):
+            converted_types[type(value).__name__] += 1
+            return str(value)
 
         try:
-            return rec(input)
+            encoded_input = dumps(input, default=convert)
+        except TypeError:
+            converted_input = self.convert_values(input)
+            return converted_input if decode else pickle_dumps(converted_input)
         except Exception:
             log = f"Payload conversion to JSON failed:\n{format_exc()}"
             self.log("error", log)
-            return {"error": log}
+            encoded_input = dumps({"error": log})
+        self.log_conversions(converted_types)
+        return loads(encoded_input) if decode else encoded_input.encode()
+
+    def make_json_compliant(self, input):
+        return self.encode(input, decode=True)
+
+    @staticmethod
+    def run_steps(steps):
+        while True:
+            try:
+                sleep(next(steps))
+            except StopIteration as result:
+                return result.value
 
     @staticmethod
-    def get_device_result(args):
-        device_id, runtime, results = args
+    def get_thread_device(device):
+        if not device or object_session(device) is db.session():
+            return device
+        return db.fetch("device", id=inspect(device).identity[0])
+
+    def get_result_step(self, steps, device_id=None):
+        if not steps:
+            steps = self.get_result_steps(db.fetch("device", id=device_id))
+        try:
+            return steps, next(steps), None
+        except StopIteration as result:
+            return steps, None, result.value
+
+    def get_thread_pool_results(self, devices):
+        processes = min(len(devices), self.get("max_processes"))
+        if self.get("multiprocessing_mode") == "asyncio":
+            processes = min(processes, vs.settings["automation"]["max_process"])
+        self.log("info", f"Starting a pool of {processes} threads")
+        timers, sequence, results = [], count(), []
+        with ThreadPoolExecutor(max_workers=processes) as executor:
+            jobs = {
+                executor.submit(self.get_result_step, None, device.id)
+                for device in devices
+            }
+            while jobs or timers:
+                timeout = max(timers[0][0] - time(), 0) if timers else None
+                if jobs:
+                    done, jobs = wait(jobs, timeout, return_when=FIRST_COMPLETED)
+                else:
+                    done = set()
+                    sleep(timeout)
+                for job in done:
+                    steps, delay, result = job.result()
+                    if delay is None:
+                        results.append(result)
+                    else:
+                        heappush(timers, (time() + delay, next(sequence), steps))
+                while timers and (self.stop or timers[0][0] <= time()):
+                    steps = heappop(timers)[2]
+                    jobs.add(executor.submit(self.get_result_step, steps))
+        return results
+
+    def get_process_snapshot(self):
+        snapshot = {
+            key: value
+            for key, value in self.__dict__.items()
+            if isinstance(value, (bool, dict, float, int, list, str, type(None)))
+            and key not in self.process_snapshot_relations
+            and key != "target_devices"
+        }
+        for property in self.process_snapshot_relations:
+            instance = self.__dict__.get(property)
+            snapshot[property] = instance.id if instance else None
+        snapshot["target_devices"] = [device.id for device in self.target_devices]
+        return snapshot
+
+    @staticmethod
+    def init_process_worker(snapshot):
+        env.init_process_worker()
+        Runner.process_snapshot = snapshot
+
+    @staticmethod
+    def get_device_result_in_process(device_id):
+        snapshot = Runner.process_snapshot
+        for store in (vs.run_logs, vs.run_states):
+            store.pop(snapshot["parent_runtime"], None)
+        runner = Runner.__new__(Runner)
+        runner.__dict__.update(snapshot, in_process_pool=True)
+        runner.result_buffer_lock, runner.state_lock = Lock(), Lock()
+        runner.payload_lock = RLock()
+        for property, model in runner.process_snapshot_relations.items():
+            if snapshot[property]:
+                setattr(runner, property, db.fetch(model, id=snapshot[property]))
+        runner.target_devices = db.fetch_in("device", "id", snapshot["target_devices"])
+        runner.main_run = db.fetch("run", runtime=runner.parent_runtime)
+        runner.base_namespace = runner.get_base_namespace()
         device = db.fetch("device", id=device_id)
-        run = vs.run_instances[runtime]
-        results.append(run.get_results(device))
+        results = runner.make_json_compliant(runner.get_results(device))
+        runner.close_device_connection(device.name)
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            runner.log("error", "\n".join(format_exc().splitlines()), device)
+        finally:
+            db.session.remove()
+        for library in ("netmiko", "napalm", "scrapli", "ncclient"):
+            vs.connections_cache[library].pop(runner.parent_runtime, None)
+        for store in (vs.run_credentials, vs.run_states):
+            store.pop(runner.parent_runtime, None)
+        env.flush_log_buffers()
+        return {
+            "logs": dict(vs.run_logs.pop(runner.parent_runtime, {})),
+            "metrics": runner.code_cache_metrics,
+            "results": results,
+            "variables": runner.payload.get("variables", {}),
+        }
+
+    def get_process_pool_results(self, devices):
+        max_workers = min(
+            len(devices),
+            self.get("max_processes"),
+            vs.settings["automation"]["process_pool"]["max_workers"],
+        )
+        self.log("info", f"Sending {len(devices)} devices to {max_workers} processes")
+        pending_devices, jobs, results = list(reversed(devices)), {}, []
+        pool = env.get_process_pool(
+            max_workers, self.init_process_worker, self.get_process_snapshot()
+        )
+        try:
+            while pending_devices or jobs:
+                stop = self.stop
+                while pending_devices and len(jobs) < max_workers and not stop:
+                    device = pending_devices.pop()
+                    job = pool.submit(self.get_device_result_in_process, device.id)
+                    jobs[job] = device
+                if stop and pending_devices:
+                    log = f"ABORTING {len(pending_devices)} devices not yet run (STOP)"
+                    self.log("error", log)
+                    pending_devices.clear()
+                if not jobs:
+                    break
+                done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+                for job in done:
+                    device = jobs.pop(job)
+                    results.append(self.process_device_result(device, job.result()))
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    def process_device_result(self, device, process_result):
+        for service_id, logs in process_result["logs"].items():
+            if logs is None:
+                vs.run_logs[self.parent_runtime][service_id] = None
+                continue
+            for log in logs:
+                env.log_queue(self.parent_runtime, service_id, log)
+        with self.code_cache_lock:
+            for metric, value in process_result["metrics"].items():
+                self.code_cache_metrics[metric] += value
+        variables = process_result["variables"]
+        with self.payload_lock:
+            payload_variables = self.payload.setdefault("variables", {})
+            payload_variables.setdefault("devices", {}).update(
+                variables.pop("devices", {})
+            )
+            payload_variables.update(variables)
+        device_results = process_result["results"]
+        status = "success" if device_results["success"] else "failure"
+        self.write_state(f"{self.progress_key}/{status}", 1, "increment")
+        self.create_result(
+            {"runtime": vs.get_time(), **device_results}, device, commit=False
+        )
+        if not device_results["success"]:
+            self.write_state("success", False)
+        return device_results
 
     def device_iteration(self, device):
         derived_devices = self.compute_devices_from_query(
@@ -307,6 +604,7 @@ class Runner:
             self.run,
             iteration_run=True,
             payload=self.payload,
+            payload_lock=self.payload_lock,
             service=self.service,
             target_devices=derived_devices,
             workflow=self.workflow,
@@ -375,6 +673,11 @@ class Runner:
             else:
                 non_skipped_targets.append(device)
         self.target_devices = non_skipped_targets
+        if (
+            isinstance(self.service, vs.models["connection_service"])
+            and self.credentials == "device"
+        ):
+            self.prefetch_credentials(self.target_devices)
         if self.run_method != "per_device":
             results = self.get_results()
             if "summary" not in results:
@@ -404,14 +707,14 @@ class Runner:
                 and not self.in_process
                 and not self.iteration_run
             ):
-                processes = min(len(non_skipped_targets), self.get("max_processes"))
-                process_args = [
-                    (device.id, self.runtime, results) for device in non_skipped_targets
-                ]
-                self.log("info", f"Starting a pool of {processes} threads")
                 self.in_process = True
-                with ThreadPool(processes=processes) as pool:
-                    pool.map(self.get_device_result, process_args)
+                mode = self.get("multiprocessing_mode")
+                if mode == "process" and self.service.type != "workflow":
+                    results.extend(self.get_process_pool_results(non_skipped_targets))
+                elif mode == "asyncio" and hasattr(self.service, "async_job"):
+                    results.extend(self.get_event_loop_results(non_skipped_targets))
+                else:
+                    results.extend(self.get_thread_pool_results(non_skipped_targets))
                 self.in_process = False
             else:
                 results.extend(
@@ -433,18 +736,18 @@ class Runner:
         self.success = results["success"]
         result_kw = {
             "parent_runtime": self.parent_runtime,
-            "parent_service_id": self.main_run.service.id,
+            "parent_service_id": self.main_run.service_id,
             "run_id": self.main_run.id,
-            "service": self.service.id,
+            "service_id": self.service.id,
+            "workflow_id": getattr(self.workflow, "id", None),
+            "parent_device_id": getattr(self.parent_device, "id", None),
+            "device_id": getattr(device, "id", None),
             "labels": self.main_run.labels,
             "creator": self.main_run.creator,
         }
-        if self.workflow:
-            result_kw["workflow"] = self.workflow.id
-        if self.parent_device:
-            result_kw["parent_device"] = self.parent_device.id
-        if device:
-            result_kw["device"] = device.id
+        results.pop("payload", None)
+        if not device:
+            results = self.make_json_compliant(results)
         if self.is_main_run and not device:
             self.payload = self.make_json_compliant(self.payload)
             results["payload"] = self.payload
@@ -463,19 +766,129 @@ class Runner:
                     if not result.device:
                         continue
                     results["devices"][result.device.name] = result.result
-        else:
-            results.pop("payload", None)
         create_failed_results = self.disable_result_creation and not self.success
-        results = self.make_json_compliant(results)
         if not self.disable_result_creation or create_failed_results or run_result:
             self.has_result = True
-            db.factory("result", result=results, commit=commit, **result_kw)
+            if device:
+                for property in ("success", "runtime", "duration"):
+                    result_kw[property] = results[property]
+                content = db.serialize(results, self.encode)
+                blob = db.get_blob_hash(content)
+                row = {"result": content, "blob": blob, **result_kw}
+                self.buffer_result(row, commit)
+            else:
+                db.factory("result", result=results, commit=commit, **result_kw)
         return results
 
-    def run_service_job(self, device):
-        args = (device,) if device else ()
+    def update_run_summary(self):
+        result, summary = vs.models["result"], vs.models["run_summary"]
+        key = {"parent_runtime": self.parent_runtime, "service_id": self.service.id}
+        total, success_count, min_runtime = (
+            db.session.query(
+                func.count(result.id),
+                func.count(case([(result.success == true(), 1)])),
+                func.min(result.runtime),
+            )
+            .filter_by(**key)
+            .one()
+        )
+        values = {
+            "success_count": success_count,
+            "failure_count": total - success_count,
+            "min_runtime": min_runtime,
+        }
+        for index in range(db.retry_commit_number):
+            try:
+                query = db.session.query(summary).filter_by(**key)
+                if not query.update(values, synchronize_session=False):
+                    row = {
+                        "run_id": self.main_run.id,
+                        "creator": self.main_run.creator,
+                        **key,
+                        **values,
+                    }
+                    db.session.execute(summary.__table__.insert(), [row])
+                db.session.commit()
+                return
+            except IntegrityError:
+                db.session.rollback()
+
+    def buffer_result(self, row, commit=True):
+        settings = vs.settings["automation"]["result_buffer"]
+        with self.result_buffer_lock:
+            self.result_buffer.append(row)
+            if (
+                len(self.result_buffer) < settings["size"]
+                and time() - self.last_result_flush < settings["interval"]
+            ):
+                rows = []
+            else:
+                rows, self.result_buffer = self.result_buffer, []
+                self.last_result_flush = time()
+        db.bulk_insert("result", rows, commit=commit)
+
+    def flush_results(self):
+        with self.result_buffer_lock:
+            rows, self.result_buffer = self.result_buffer, []
+            self.last_result_flush = time()
+        db.bulk_insert("result", rows)
+
+    def run_preprocessing(_self, **locals):  # noqa: N805
+        if not _self.service.preprocessing:
+            return
+        try:
+            _self.eval(_self.service.preprocessing, function="exec", **locals)
+        except SystemExit:
+            pass
+
+    def process_job_results(_self, results, retries, **locals):  # noqa: N805
+        device = locals.get("device")
+        results = _self.convert_result(results)
+        if "success" not in results:
+            results["success"] = True
+        if _self.service.postprocessing:
+            if (
+                _self.postprocessing_mode == "always"
+                or _self.postprocessing_mode == "failure"
+                and not results["success"]
+                or _self.postprocessing_mode == "success"
+                and results["success"]
+            ):
+                try:
+                    _, exec_variables = _self.eval(
+                        _self.service.postprocessing,
+                        function="exec",
+                        **{**locals, "results": results, "retries": retries},
+                    )
+                    if isinstance(exec_variables.get("retries"), int):
+                        retries = exec_variables["retries"]
+                except SystemExit:
+                    pass
+            else:
+                log = (
+                    "Postprocessing was skipped as it is set to "
+                    f"{_self.postprocessing_mode} only, but the service "
+                    f"{'passed' if results['success'] else 'failed'})"
+                )
+                _self.log("warning", log, device)
+        run_validation = (
+            _self.validation_condition == "always"
+            or _self.validation_condition == "failure"
+            and not results["success"]
+            or _self.validation_condition == "success"
+            and results["success"]
+        )
+        if run_validation:
+            section = _self.eval(_self.validation_section, results=results)[0]
+            results.update(_self.validate_result(section, device))
+            if _self.negative_logic:
+                results["success"] = not results["success"]
+        return results, retries
+
+    def get_service_job_steps(self, device):
         retries, total_retries = self.number_of_retries + 1, 0
         while retries and total_retries < self.max_number_of_retries:
+            args = (device,) if device else ()
             if self.stop:
                 self.log("error", f"ABORTING {device.name} (STOP)")
                 return {"success": False, "result": "Aborted"}
@@ -485,68 +898,87 @@ class Runner:
                 if self.number_of_retries - retries:
                     retry = self.number_of_retries - retries
                     self.log("error", f"RETRY n°{retry}", device)
-                if self.service.preprocessing:
-                    try:
-                        self.eval(
-                            self.service.preprocessing, function="exec", **locals()
-                        )
-                    except SystemExit:
-                        pass
+                self.run_preprocessing(**locals())
                 try:
                     results = self.service.job(self, *args)
                 except Exception:
                     result = "\n".join(format_exc().splitlines())
                     self.log("error", result, device)
                     results = {"success": False, "result": result}
-                results = self.convert_result(results)
-                if "success" not in results:
-                    results["success"] = True
-                if self.service.postprocessing:
-                    if (
-                        self.postprocessing_mode == "always"
-                        or self.postprocessing_mode == "failure"
-                        and not results["success"]
-                        or self.postprocessing_mode == "success"
-                        and results["success"]
-                    ):
-                        try:
-                            _, exec_variables = self.eval(
-                                self.service.postprocessing, function="exec", **locals()
-                            )
-                            if isinstance(exec_variables.get("retries"), int):
-                                retries = exec_variables["retries"]
-                        except SystemExit:
-                            pass
-                    else:
-                        log = (
-                            "Postprocessing was skipped as it is set to "
-                            f"{self.postprocessing_mode} only, but the service "
-                            f"{'passed' if results['success'] else 'failed'})"
-                        )
-                        self.log("warning", log, device)
-                run_validation = (
-                    self.validation_condition == "always"
-                    or self.validation_condition == "failure"
-                    and not results["success"]
-                    or self.validation_condition == "success"
-                    and results["success"]
-                )
-                if run_validation:
-                    section = self.eval(self.validation_section, results=results)[0]
-                    results.update(self.validate_result(section, device))
-                    if self.negative_logic:
-                        results["success"] = not results["success"]
+                results, retries = self.process_job_results(**locals())
                 if results["success"]:
                     return results
                 elif retries:
-                    sleep(self.time_between_retries)
+                    yield self.time_between_retries
+                    device = self.get_thread_device(device)
             except Exception:
                 result = "\n".join(format_exc().splitlines())
                 self.log("error", result, device)
                 results = {"success": False, "result": result}
         return results
 
+    async def run_async_service_job(self, device):
+        retries, total_retries = self.number_of_retries + 1, 0
+        while retries and total_retries < self.max_number_of_retries:
+            if await self.run_blocking(getattr, self, "stop"):
+                await self.run_blocking(
+                    self.log, "error", f"ABORTING {device.name} (STOP)"
+                )
+                return {"success": False, "result": "Aborted"}
+            retries -= 1
+            total_retries += 1
+            try:
+                if self.number_of_retries - retries:
+                    retry = self.number_of_retries - retries
+                    await self.run_blocking(
+                        self.log, "error", f"RETRY n°{retry}", device
+                    )
+                await self.run_blocking(self.run_preprocessing, **locals())
+                try:
+                    results = await self.service.async_job(self, device)
+                except Exception:
+                    result = "\n".join(format_exc().splitlines())
+                    await self.run_blocking(self.log, "error", result, device)
+                    results = {"success": False, "result": result}
+                results, retries = await self.run_blocking(
+                    self.process_job_results, **locals()
+                )
+                if results["success"]:
+                    return results
+                elif retries:
+                    await async_sleep(self.time_between_retries)
+            except Exception:
+                result = "\n".join(format_exc().splitlines())
+                await self.run_blocking(self.log, "error", result, device)
+                results = {"success": False, "result": result}
+        return results
+
+    def get_iteration_targets(_self, **locals):  # noqa: N805
+        targets = _self.eval(_self.service.iteration_values, **locals)[0]
+        if not isinstance(targets, dict):
+            if isinstance(targets, (GeneratorType, map, filter)):
+                targets = list(targets)
+            targets = dict(zip(map(str, targets), targets))
+        return targets
+
+    def end_device_run(self, device, results, start, commit):
+        results["duration"] = str(datetime.now().replace(microsecond=0) - start)
+        if device and not self.in_process_pool:
+            if getattr(self, "close_connection", False) or self.is_main_run:
+                self.close_device_connection(device.name)
+            status = "success" if results["success"] else "failure"
+            self.write_state(f"{self.progress_key}/{status}", 1, "increment")
+            self.create_result(
+                {"runtime": vs.get_time(), **results}, device, commit=commit
+            )
+        self.log("info", "FINISHED", device)
+        if not results["success"] and not self.in_process_pool:
+            self.write_state("success", False)
+
     def get_results(self, device=None, commit=True):
+        return self.run_steps(self.get_result_steps(device, commit))
+
+    def get_result_steps(self, device=None, commit=True):
         self.log("info", "STARTING", device)
         start = datetime.now().replace(microsecond=0)
         results = {"device_target": getattr(device, "name", None)}
@@ -555,18 +987,16 @@ class Runner:
         try:
             if self.service.iteration_values:
                 targets_results = {}
-                targets = self.eval(self.service.iteration_values, **locals())[0]
-                if not isinstance(targets, dict):
-                    if isinstance(targets, (GeneratorType, map, filter)):
-                        targets = list(targets)
-                    targets = dict(zip(map(str, targets), targets))
+                targets = self.get_iteration_targets(**locals())
                 for target_name, target_value in targets.items():
                     self.payload_helper(
                         self.iteration_variable_name,
                         target_value,
                         device=getattr(device, "name", None),
                     )
-                    targets_results[target_name] = self.run_service_job(device)
+                    job_steps = self.get_service_job_steps(device)
+                    targets_results[target_name] = yield from job_steps
+                    device = self.get_thread_device(device)
                 results.update(
                     {
                         "result": targets_results,
@@ -576,28 +1006,94 @@ class Runner:
                     }
                 )
             else:
-                results.update(self.run_service_job(device))
+                results.update((yield from self.get_service_job_steps(device)))
+                device = self.get_thread_device(device)
         except Exception:
             formatted_error = "\n".join(format_exc().splitlines())
             results.update({"success": False, "result": formatted_error})
             self.log("error", formatted_error, device)
-        results["duration"] = str(datetime.now().replace(microsecond=0) - start)
-        if device:
-            if getattr(self, "close_connection", False) or self.is_main_run:
-                self.close_device_connection(device.name)
-            status = "success" if results["success"] else "failure"
-            self.write_state(f"{self.progress_key}/{status}", 1, "increment")
-            self.create_result(
-                {"runtime": vs.get_time(), **results}, device, commit=commit
-            )
-        self.log("info", "FINISHED", device)
+        self.end_device_run(device, results, start, commit)
         if self.waiting_time:
             self.log("info", f"SLEEP {self.waiting_time} seconds...", device)
-            sleep(self.waiting_time)
-        if not results["success"]:
-            self.write_state("success", False)
+            yield self.waiting_time
+        return results
+
+    async def run_blocking(_self, _function, *args, **kwargs):  # noqa: N805
+        return await get_running_loop().run_in_executor(
+            _self.async_executor, partial(_function, *args, **kwargs)
+        )
+
+    async def get_async_results(self, device):
+        await self.run_blocking(self.log, "info", "STARTING", device)
+        start = datetime.now().replace(microsecond=0)
+        results = {"device_target": device.name}
+        if await self.run_blocking(getattr, self, "stop"):
+            return {"success": False, **results}
+        try:
+            if self.service.iteration_values:
+                targets_results = {}
+                targets = await self.run_blocking(
+                    self.get_iteration_targets, **locals()
+                )
+                for target_name, target_value in targets.items():
+                    self.payload_helper(
+                        self.iteration_variable_name, target_value, device=device.name
+                    )
+                    targets_results[target_name] = await self.run_async_service_job(
+                        device
+                    )
+                results.update(
+                    {
+                        "result": targets_results,
+                        "success": all(
+                            result["success"] for result in targets_results.values()
+                        ),
+                    }
+                )
+            else:
+                results.update(await self.run_async_service_job(device))
+        except Exception:
+            formatted_error = "\n".join(format_exc().splitlines())
+            results.update({"success": False, "result": formatted_error})
+            await self.run_blocking(self.log, "error", formatted_error, device)
+        finally:
+            await self.close_async_connections(device)
+        await self.run_blocking(self.end_device_run, device, results, start, True)
+        if self.waiting_time:
+            await self.run_blocking(
+                self.log, "info", f"SLEEP {self.waiting_time} seconds...", device
+            )
+            await async_sleep(self.waiting_time)
         return results
 
+    def get_async_credentials(self, devices):
+        credentials = {}
+        for device in devices:
+            try:
+                credentials[device.name] = self.get_credentials(device)
+            except Exception as exc:
+                credentials[device.name] = exc
+        return credentials
+
+    def get_event_loop_results(self, devices):
+        max_sessions = min(len(devices), self.get("max_processes"))
+        self.log("info", f"Starting an event loop with {max_sessions} sessions")
+        self.async_credentials = self.get_async_credentials(devices)
+        self.async_connections = {}
+        max_threads = min(max_sessions, vs.settings["automation"]["max_process"])
+
+        async def run_devices():
+            semaphore = Semaphore(max_sessions)
+
+            async def run_device(device):
+                async with semaphore:
+                    return await self.get_async_results(device)
+
+            return await gather(*(run_device(device) for device in devices))
+
+        with ThreadPoolExecutor(max_workers=max_threads) as self.async_executor:
+            return run_coroutine(run_devices())
+
     def log(
         self,
         severity,
@@ -621,13 +1117,24 @@ class Runner:
         if device:
             device_name = device if isinstance(device, str) else device.name
             log = f"DEVICE {device_name} - {log}"
-        full_log = (
-            f"RUNTIME {self.parent_runtime} - USER {self.creator} -"
-            f" SERVICE '{self.service.name}' - {log}"
-        )
-        settings = env.log(
-            severity, full_log, user=self.creator, change_log=change_log, logger=logger
-        )
+        settings = vs.logging["loggers"].get(logger, {}) if logger else {}
+        if (
+            change_log
+            or settings.get("change_log")
+            or logger
+            and getLogger(logger).isEnabledFor(getLevelName(severity.upper()))
+        ):
+            full_log = (
+                f"RUNTIME {self.parent_runtime} - USER {self.creator} -"
+                f" SERVICE '{self.service.name}' - {log}"
+            )
+            env.log(
+                severity,
+                full_log,
+                user=self.creator,
+                change_log=change_log,
+                logger=logger,
+            )
         if service_log or logger and settings.get("service_log"):
             run_log = (
                 f"{vs.get_time()} - {severity} - USER {self.creator} -"
@@ -701,25 +1208,100 @@ class Runner:
         results["notification"] = {"success": True, "result": result}
         return results
 
+    def prefetch_credentials(self, devices):
+        credential_type = self.main_run.service.credential_type
+        cache = vs.run_credentials[self.parent_runtime]["devices"]
+        device_ids = [
+            device.id for device in devices if (credential_type, device.id) not in cache
+        ]
+        if not device_ids:
+            return
+        credentials = db.get_device_credentials(
+            self.creator, device_ids, credential_type=credential_type
+        )
+        if env.use_vault:
+            loaded = vs.run_credentials[self.parent_runtime]["credentials"]
+            pending = {
+                credential.id: credential
+                for credential in credentials.values()
+                if credential.id not in loaded
+            }
+            env.prefetch_vault_secrets(
+                [
+                    env.get_vault_path(credential, property)
+                    for credential in pending.values()
+                    for property in (
+                        "enable_password",
+                        "password"
+                        if credential.subtype == "password"
+                        else "private_key",
+                    )
+                ]
+            )
+        errors = vs.run_credentials[self.parent_runtime]["errors"]
+        for device_id in device_ids:
+            credential = credentials.get(device_id)
+            if credential and credential.id not in errors:
+                try:
+                    self.load_credential(credential)
+                except Exception as exc:
+                    errors[
+                        credential.id
+                    ] = f"Failed to load credential '{credential.name}' ({exc})"
+            cache[(credential_type, device_id)] = getattr(credential, "id", None)
+
+    def load_credential(self, credential):
+        cache = vs.run_credentials[self.parent_runtime]["credentials"]
+        if credential.id in cache:
+            return cache[credential.id]
+        material = {
+            "name": credential.name,
+            "username": credential.username,
+            "subtype": credential.subtype,
+            "secret": env.get_password(credential.enable_password),
+        }
+        if credential.subtype == "password":
+            material["password"] = env.get_password(credential.password)
+        else:
+            private_key = env.get_password(credential.private_key)
+            material["pkey"] = RSAKey.from_private_key(StringIO(private_key))
+        cache[credential.id] = material
+        return material
+
+    def get_device_credential(self, device, optional=False):
+        credential_type = self.main_run.service.credential_type
+        if not device:
+            credential = db.get_credential(
+                self.creator, credential_type=credential_type, optional=optional
+            )
+            return self.load_credential(credential) if credential else None
+        run_credentials = vs.run_credentials[self.parent_runtime]
+        if (credential_type, device.id) not in run_credentials["devices"]:
+            self.prefetch_credentials([device])
+        credential_id = run_credentials["devices"][(credential_type, device.id)]
+        if credential_id is None:
+            if optional:
+                return
+            raise Exception(f"No matching credentials found for DEVICE '{device.name}'")
+        if credential_id in run_credentials["errors"]:
+            raise Exception(run_credentials["errors"][credential_id])
+        return run_credentials["credentials"][credential_id]
+
     def get_credentials(self, device, add_secret=True):
-        result, credential_type = {}, self.main_run.service.credential_type
-        credential = db.get_credential(
-            self.creator,
-            device=device,
-            credential_type=credential_type,
-            optional=self.credentials != "device",
+        result = {}
+        credential = self.get_device_credential(
+            device, optional=self.credentials != "device"
         )
         if add_secret and device and credential:
-            log = f"Using '{credential.name}' credential for '{device.name}'"
+            log = f"Using '{credential['name']}' credential for '{device.name}'"
             self.log("info", log)
-            result["secret"] = env.get_password(credential.enable_password)
+            result["secret"] = credential["secret"]
         if self.credentials == "device":
-            result["username"] = credential.username
-            if credential.subtype == "password":
-                result["password"] = env.get_password(credential.password)
+            result["username"] = credential["username"]
+            if credential["subtype"] == "password":
+                result["password"] = credential["password"]
             else:
-                private_key = env.get_password(credential.private_key)
-                result["pkey"] = RSAKey.from_private_key(StringIO(private_key))
+                result["pkey"] = credential["pkey"]
         elif self.credentials == "user":
             user = db.fetch("user", name=self.creator)
             result["username"] = user.name
@@ -754,45 +1336,69 @@ class Runner:
             }
         return result
 
+    def get_validation_matcher(self, variables):
+        text_validation = self.validation_method == "text"
+        template = self.content_match if text_validation else self.dict_match
+        if self.static_validation is None:
+            self.static_validation = "{{" not in str(template)
+        match = template if self.static_validation else self.sub(template, variables)
+        key = None if self.static_validation else str(match)
+        if key not in self.validation_matchers:
+            if text_validation:
+                if self.delete_spaces_before_matching:
+                    match = self.space_deleter(match)
+                matcher = compile(match) if self.content_match_regex else match
+            else:
+                matcher = {
+                    name: ListMatch(value) if isinstance(value, list) else value
+                    for name, value in match.items()
+                }
+            self.validation_matchers[key] = (match, matcher)
+        return self.validation_matchers[key]
+
     def validate_result(self, section, device):
+        match, matcher = self.get_validation_matcher(locals())
         if self.validation_method == "text":
-            match = self.sub(self.content_match, locals())
             str_section = str(section)
             if self.delete_spaces_before_matching:
-                match, str_section = map(self.space_deleter, (match, str_section))
-            success = (
-                self.content_match_regex
-                and bool(search(match, str_section))
-                or match in str_section
-                and not self.content_match_regex
-            )
+                str_section = self.space_deleter(str_section)
+            if self.content_match_regex:
+                success = bool(matcher.search(str_section))
+            else:
+                success = matcher in str_section
         else:
-            match = self.sub(self.dict_match, locals())
-            success = self.match_dictionary(section, match)
+            success = self.match_dictionary(section, matcher)
         validation = {"path": self.validation_section, "value": section, "match": match}
         return {"success": success, "validation": validation}
 
     def match_dictionary(self, result, match, first=True):
         if self.validation_method == "dict_equal":
             return result == self.dict_match
-        else:
-            copy = deepcopy(match) if first else match
-            if isinstance(result, dict):
-                for k, v in result.items():
-                    if isinstance(copy.get(k), list) and isinstance(v, list):
-                        for item in v:
-                            try:
-                                copy[k].remove(item)
-                            except ValueError:
-                                pass
-                        pop_key = not copy[k]
-                    else:
-                        pop_key = k in copy and copy[k] == v
-                    copy.pop(k) if pop_key else self.match_dictionary(v, copy, False)
-            elif isinstance(result, list):
-                for item in result:
-                    self.match_dictionary(item, copy, False)
-            return not copy
+        if first:
+            match = {
+                key: value.copy() if isinstance(value, ListMatch) else value
+                for key, value in match.items()
+            }
+        if isinstance(result, dict):
+            for key, value in result.items():
+                if not match:
+                    break
+                expected = match.get(key)
+                if isinstance(expected, ListMatch) and isinstance(value, list):
+                    for item in value:
+                        expected.remove(item)
+                    pop_key = not expected
+                else:
+                    pop_key = key in match and expected == value
+                match.pop(key) if pop_key else self.match_dictionary(
+                    value, match, False
+                )
+        elif isinstance(result, list):
+            for item in result:
+                if not match:
+                    break
+                self.match_dictionary(item, match, False)
+        return not match
 
     def transfer_file(self, ssh_client, files):
         if self.protocol == "sftp":
@@ -821,18 +1427,19 @@ class Runner:
         allow_none=False,
         default=None,
     ):
-        payload = self.payload.setdefault("variables", {})
-        if device:
-            payload = payload.setdefault("devices", {})
-            payload = payload.setdefault(device, {})
-        if section:
-            payload = payload.setdefault(section, {})
-        if value is None:
-            value = default
-        if operation in ("get", "__setitem__", "setdefault"):
-            value = getattr(payload, operation)(name, value)
-        else:
-            getattr(payload[name], operation)(value)
+        with self.payload_lock:
+            payload = self.payload.setdefault("variables", {})
+            if device:
+                payload = payload.setdefault("devices", {})
+                payload = payload.setdefault(device, {})
+            if section:
+                payload = payload.setdefault(section, {})
+            if value is None:
+                value = default
+            if operation in ("get", "__setitem__", "setdefault"):
+                value = getattr(payload, operation)(name, value)
+            else:
+                getattr(payload[name], operation)(value)
         if operation == "get" and not allow_none and value is None:
             raise Exception(f"Payload Editor: {name} not found in {payload}.")
         else:
@@ -842,37 +1449,44 @@ class Runner:
         return self.payload_helper(*args, operation="get", **kwargs)
 
     def get_result(self, service_name, device=None, workflow=None):
-        def filter_run(query, property):
-            query = query.filter(
-                vs.models["result"].service.has(
-                    getattr(vs.models["service"], property) == service_name
-                )
-            )
-            return query.all()
+        result = vs.models["result"]
 
-        def recursive_search(run):
-            if not run:
-                return None
-            query = db.session.query(vs.models["result"]).filter(
-                vs.models["result"].parent_runtime == run.runtime
+        def get_ids(model, property, value):
+            table = vs.models[model]
+            query = db.session.query(table.id).filter(getattr(table, property) == value)
+            return [id for (id,) in query.all()]
+
+        service_ids = [
+            ids
+            for ids in (
+                get_ids("service", "scoped_name", service_name),
+                get_ids("service", "name", service_name),
+            )
+            if ids
+        ]
+        constraints = []
+        if workflow:
+            constraints.append(
+                result.workflow_id.in_(get_ids("workflow", "name", workflow))
             )
-            if workflow:
-                query = query.filter(
-                    vs.models["result"].workflow.has(
-                        vs.models["workflow"].name == workflow
+        if device:
+            constraints.append(result.device_id.in_(get_ids("device", "name", device)))
+        run = self.main_run
+        while run:
+            for ids in service_ids:
+                match = (
+                    db.session.query(result)
+                    .filter(
+                        result.parent_runtime == run.runtime,
+                        result.service_id.in_(ids),
+                        *constraints,
                     )
+                    .order_by(result.id.desc())
+                    .first()
                 )
-            if device:
-                query = query.filter(
-                    vs.models["result"].device.has(vs.models["device"].name == device)
-                )
-            results = filter_run(query, "scoped_name") or filter_run(query, "name")
-            if not results:
-                return recursive_search(run.restart_run)
-            else:
-                return results.pop().result
-
-        return recursive_search(self.main_run)
+                if match:
+                    return match.result
+            run = run.restart_run
 
     @staticmethod
     def _import(module, *args, **kwargs):
@@ -897,60 +1511,102 @@ class Runner:
         credential_dict["secret"] = env.get_password(credential.enable_password)
         return credential_dict
 
+    def get_base_namespace(self):
+        namespace = {
+            "__builtins__": {**builtins, "__import__": self._import},
+            "delete": partial(self.database_function, "delete"),
+            "dict_to_string": vs.dict_to_string,
+            "encrypt": env.encrypt_password,
+            "factory": partial(self.database_function, "factory"),
+            "fetch": partial(self.database_function, "fetch"),
+            "fetch_all": partial(self.database_function, "fetch_all"),
+            "get_connection": self.get_connection,
+            "get_result": self.get_result,
+            "get_var": self.get_var,
+            "log": self.log,
+            "send_email": env.send_email,
+            "server": {
+                "ip_address": vs.server_ip,
+                "name": vs.server,
+                "url": vs.server_url,
+            },
+            "set_var": self.payload_helper,
+            "settings": vs.settings,
+            "username": self.main_run.creator,
+        }
+        if self.is_admin_run:
+            namespace["get_credential"] = self.get_credential
+        return MappingProxyType(namespace)
+
     def global_variables(_self, **locals):  # noqa: N805
         payload, device = _self.payload, locals.get("device")
         variables = {**locals, **payload.get("form", {})}
         variables.update(payload.get("variables", {}))
         if device and "devices" in payload.get("variables", {}):
             variables.update(payload["variables"]["devices"].get(device.name, {}))
+        variables.update(_self.base_namespace)
         variables.update(
             {
-                "__builtins__": {**builtins, "__import__": _self._import},
-                "delete": partial(_self.database_function, "delete"),
                 "devices": _self.target_devices,
-                "dict_to_string": vs.dict_to_string,
-                "encrypt": env.encrypt_password,
-                "factory": partial(_self.database_function, "factory"),
-                "fetch": partial(_self.database_function, "fetch"),
-                "fetch_all": partial(_self.database_function, "fetch_all"),
-                "get_connection": _self.get_connection,
-                "get_result": _self.get_result,
-                "get_var": _self.get_var,
-                "log": _self.log,
                 "parent_device": _self.parent_device or device,
-                "payload": _self.payload,
+                "payload": payload,
                 "placeholder": _self.main_run.placeholder,
-                "send_email": env.send_email,
-                "server": {
-                    "ip_address": vs.server_ip,
-                    "name": vs.server,
-                    "url": vs.server_url,
-                },
-                "set_var": _self.payload_helper,
-                "settings": vs.settings,
-                "username": _self.main_run.creator,
                 "workflow": _self.workflow,
             }
         )
-        if _self.is_admin_run:
-            variables["get_credential"] = _self.get_credential
         return variables
 
+    def exec_variables(_self, **locals):  # noqa: N805
+        variables = _self.global_variables(**locals)
+        variables["__builtins__"] = dict(variables["__builtins__"])
+        return variables
+
+    def get_compiled_code(self, source, mode):
+        key = (source, mode)
+        with self.code_cache_lock:
+            code = self.code_cache.get(key)
+            if code is not None:
+                self.code_cache.move_to_end(key)
+                self.code_cache_metrics["hits"] += 1
+                return code
+            self.code_cache_metrics["misses"] += 1
+        if mode == "sub":
+            code = tuple(
+                self.get_compiled_code(part, "eval") if index % 2 else part
+                for index, part in enumerate(self.substitution_regex.split(source))
+            )
+        else:
+            if mode == "eval":
+                source = source.lstrip(" \t")
+            code = builtins["compile"](source, "<string>", mode)
+        with self.code_cache_lock:
+            self.code_cache[key] = code
+            if len(self.code_cache) > vs.settings["automation"]["code_cache_size"]:
+                self.code_cache.popitem(last=False)
+        return code
+
     def eval(_self, query, function="eval", **locals):  # noqa: N805
-        exec_variables = _self.global_variables(**locals)
+        if function == "exec":
+            exec_variables = _self.exec_variables(**locals)
+        else:
+            exec_variables = _self.global_variables(**locals)
+        if query and isinstance(query, str):
+            query = _self.get_compiled_code(query, function)
         results = builtins[function](query, exec_variables) if query else ""
         return results, exec_variables
 
     def sub(self, input, variables):
-        regex = compile("{{(.*?)}}")
         variables["payload"] = self.payload
 
-        def replace(match):
-            return str(self.eval(match.group()[2:-2], **variables)[0])
-
         def rec(input):
             if isinstance(input, str):
-                return regex.sub(replace, input)
+                template = self.get_compiled_code(input, "sub")
+                if len(template) == 1:
+                    return input
+                return "".join(
+                    str(self.eval(part, **variables)[0]) if index % 2 else part
+                    for index, part in enumerate(template)
+                )
             elif isinstance(input, list):
                 return [rec(item) for item in input]
             elif isinstance(input, dict):
@@ -1001,6 +1657,12 @@ class Runner:
         if connection:
             self.log("info", f"Using cached {connection_name}", device)
             return self.update_netmiko_connection(connection)
+        driver = device.netmiko_driver if self.driver == "device" else self.driver
+        credentials = self.get_credentials(device)
+        pool_key = self.get_pool_key("netmiko", device, driver, credentials)
+        connection = self.get_pooled_connection("netmiko", device, pool_key)
+        if connection:
+            return self.update_netmiko_connection(connection)
         self.log(
             "info",
             f"OPENING {connection_name}",
@@ -1008,19 +1670,22 @@ class Runner:
             change_log=False,
             logger="security",
         )
-        driver = device.netmiko_driver if self.driver == "device" else self.driver
         sock = None
         if device.gateways:
             gateways = sorted(device.gateways, key=attrgetter("priority"), reverse=True)
             for gateway in gateways:
                 try:
-                    credentials = self.get_credentials(gateway, add_secret=False)
+                    gateway_credentials = self.get_credentials(
+                        gateway, add_secret=False
+                    )
                     connection_log = f"Trying to establish connection to {gateway}"
                     self.log("info", connection_log, device, logger="security")
                     client = SSHClient()
                     client.set_missing_host_key_policy(AutoAddPolicy())
                     client.connect(
-                        hostname=gateway.ip_address, port=gateway.port, **credentials
+                        hostname=gateway.ip_address,
+                        port=gateway.port,
+                        **gateway_credentials,
                     )
                     sock = client.get_transport().open_channel(
                         "direct-tcpip", (device.ip_address, device.port), ("", 0)
@@ -1029,17 +1694,23 @@ class Runner:
                 except Exception:
                     error_log = f"Connection to {gateway} failed:\n{format_exc()}"
                     self.log("error", error_log, device)
-        netmiko_connection = ConnectHandler(
-            device_type=driver,
-            ip=device.ip_address,
-            port=device.port,
-            fast_cli=self.fast_cli,
-            timeout=self.timeout,
-            global_delay_factor=self.global_delay_factor,
-            session_log=BytesIO(),
-            global_cmd_verify=False,
-            sock=sock,
-            **self.get_credentials(device),
+        netmiko_connection = self.open_session(
+            "netmiko",
+            device,
+            driver,
+            partial(
+                ConnectHandler,
+                device_type=driver,
+                ip=device.ip_address,
+                port=device.port,
+                fast_cli=self.fast_cli,
+                timeout=self.timeout,
+                global_delay_factor=self.global_delay_factor,
+                session_log=BytesIO(),
+                global_cmd_verify=False,
+                sock=sock,
+                **credentials,
+            ),
         )
         if self.enable_mode:
             netmiko_connection.enable()
@@ -1048,59 +1719,127 @@ class Runner:
             if getattr(self, "config_mode_command", None):
                 kwargs["config_command"] = self.config_mode_command
             netmiko_connection.config_mode(**kwargs)
-        vs.connections_cache["netmiko"][self.parent_runtime].setdefault(
-            device.name, {}
-        )[self.connection_name] = netmiko_connection
-        return netmiko_connection
+        return self.cache_connection("netmiko", device, netmiko_connection, pool_key)
 
-    def scrapli_connection(self, device):
-        connection = self.get_or_close_connection("scrapli", device.name)
-        connection_name = f"Scrapli Connection '{self.connection_name}'"
-        if connection:
-            self.log("info", f"Using cached {connection_name}", device)
-            return connection
-        self.log(
-            "info",
-            f"OPENING {connection_name}",
-            device,
-            change_log=False,
-            logger="security",
-        )
-        credentials = self.get_credentials(device)
+    def get_scrapli_platform(self, device):
+        if self.service.type == "scrapli_netconf_service":
+            return device.netconf_driver or "default"
+        return device.scrapli_driver if self.driver == "device" else self.driver
+
+    def get_scrapli_driver(self, device, asynchronous=False, credentials=None):
+        credentials = credentials or self.get_credentials(device)
         is_netconf = self.service.type == "scrapli_netconf_service"
-        connection_class, kwargs = NetconfDriver if is_netconf else Scrapli, {}
+        if asynchronous:
+            driver = AsyncNetconfDriver if is_netconf else AsyncScrapli
+            kwargs = {"transport": vs.automation["scrapli"]["async_transport"]}
+        else:
+            driver, kwargs = NetconfDriver if is_netconf else Scrapli, {}
         if is_netconf:
             kwargs["strip_namespaces"] = self.strip_namespaces
         else:
-            platform = device.scrapli_driver if self.driver == "device" else self.driver
             kwargs.update(
                 {
-                    "transport": self.transport,
-                    "platform": platform,
+                    "platform": self.get_scrapli_platform(device),
                     "timeout_socket": self.timeout_socket,
                     "timeout_transport": self.timeout_transport,
                     "timeout_ops": self.timeout_ops,
                 }
             )
-        connection = connection_class(
+            kwargs.setdefault("transport", self.transport)
+        return driver(
             host=device.ip_address,
             auth_username=credentials["username"],
             auth_password=credentials["password"],
             **vs.automation["scrapli"]["connection_args"],
             **kwargs,
         )
-        connection.open()
-        vs.connections_cache["scrapli"][self.parent_runtime].setdefault(
-            device.name, {}
-        )[self.connection_name] = connection
+
+    def scrapli_connection(self, device):
+        connection = self.get_or_close_connection("scrapli", device.name)
+        connection_name = f"Scrapli Connection '{self.connection_name}'"
+        if connection:
+            self.log("info", f"Using cached {connection_name}", device)
+            return connection
+        platform = self.get_scrapli_platform(device)
+        credentials = self.get_credentials(device)
+        pool_key = self.get_pool_key("scrapli", device, platform, credentials)
+        connection = self.get_pooled_connection("scrapli", device, pool_key)
+        if connection:
+            return connection
+        self.log(
+            "info",
+            f"OPENING {connection_name}",
+            device,
+            change_log=False,
+            logger="security",
+        )
+        connection = self.get_scrapli_driver(device, credentials=credentials)
+        self.open_session("scrapli", device, platform, connection.open)
+        return self.cache_connection("scrapli", device, connection, pool_key)
+
+    @asynccontextmanager
+    async def async_scrapli_connection(self, device):
+        key = (device.name, self.connection_name)
+        connection, _ = self.async_connections.get(key, (None, None))
+        if not connection or not connection.isalive():
+            connection = await self.open_async_scrapli_connection(device)
+        yield connection
+
+    async def open_async_scrapli_connection(self, device):
+        await self.run_blocking(
+            self.log,
+            "info",
+            f"OPENING Asynchronous Scrapli Connection '{self.connection_name}'",
+            device,
+            change_log=False,
+            logger="security",
+        )
+        credentials = self.async_credentials[device.name]
+        if isinstance(credentials, Exception):
+            raise credentials
+        session = (self.runtime, "async_scrapli", device.name, self.connection_name)
+        platform = self.get_scrapli_platform(device)
+        acquire_session = partial(
+            env.acquire_session, session, device.name, "scrapli", platform
+        )
+        await get_running_loop().run_in_executor(None, acquire_session)
+        try:
+            connection = self.get_scrapli_driver(
+                device, asynchronous=True, credentials=credentials
+            )
+            await connection.open()
+        except Exception:
+            env.release_session(session)
+            raise
+        self.async_connections[(device.name, self.connection_name)] = (
+            connection,
+            session,
+        )
         return connection
 
+    async def close_async_connections(self, device):
+        for key in [key for key in self.async_connections if key[0] == device.name]:
+            connection, session = self.async_connections.pop(key)
+            try:
+                await connection.close()
+            except Exception as exc:
+                log = f"Error while closing asynchronous scrapli connection ({exc})"
+                await self.run_blocking(self.log, "error", log, device)
+            finally:
+                env.release_session(session)
+
     def napalm_connection(self, device):
         connection = self.get_or_close_connection("napalm", device.name)
         connection_name = f"NAPALM Connection '{self.connection_name}'"
         if connection:
             self.log("info", f"Using cached {connection_name}", device)
             return connection
+        driver = device.napalm_driver if self.driver == "device" else self.driver
+        credentials = self.get_credentials(device)
+        pool_key = self.get_pool_key("napalm", device, driver, credentials)
+        connection = self.get_pooled_connection("napalm", device, pool_key)
+        if connection:
+            return connection
         self.log(
             "info",
             f"OPENING {connection_name}",
@@ -1108,26 +1847,19 @@ class Runner:
             change_log=False,
             logger="security",
         )
-        credentials = self.get_credentials(device)
         optional_args = self.service.optional_args
         if not optional_args:
             optional_args = {}
         if "secret" not in optional_args:
             optional_args["secret"] = credentials.pop("secret", None)
-        driver = get_network_driver(
-            device.napalm_driver if self.driver == "device" else self.driver
-        )
-        napalm_connection = driver(
+        napalm_connection = get_network_driver(driver)(
             hostname=device.ip_address,
             timeout=self.timeout,
             optional_args=optional_args,
             **credentials,
         )
-        napalm_connection.open()
-        vs.connections_cache["napalm"][self.parent_runtime].setdefault(device.name, {})[
-            self.connection_name
-        ] = napalm_connection
-        return napalm_connection
+        self.open_session("napalm", device, driver, napalm_connection.open)
+        return self.cache_connection("napalm", device, napalm_connection, pool_key)
 
     def ncclient_connection(self, device):
         connection = self.get_or_close_connection("ncclient", device.name)
@@ -1135,6 +1867,12 @@ class Runner:
         if connection:
             self.log("info", f"Using cached {connection_name}", device)
             return connection
+        driver = device.netconf_driver or "default"
+        credentials = self.get_credentials(device)
+        pool_key = self.get_pool_key("ncclient", device, driver, credentials)
+        connection = self.get_pooled_connection("ncclient", device, pool_key)
+        if connection:
+            return connection
         self.log(
             "info",
             f"OPENING {connection_name}",
@@ -1142,20 +1880,45 @@ class Runner:
             change_log=False,
             logger="security",
         )
-        credentials = self.get_credentials(device)
-        ncclient_connection = manager.connect(
-            host=device.ip_address,
-            port=830,
-            hostkey_verify=False,
-            look_for_keys=False,
-            device_params={"name": device.netconf_driver or "default"},
-            username=credentials["username"],
-            password=credentials["password"],
+        ncclient_connection = self.open_session(
+            "ncclient",
+            device,
+            driver,
+            partial(
+                manager.connect,
+                host=device.ip_address,
+                port=830,
+                hostkey_verify=False,
+                look_for_keys=False,
+                device_params={"name": driver},
+                username=credentials["username"],
+                password=credentials["password"],
+            ),
         )
-        vs.connections_cache["ncclient"][self.parent_runtime].setdefault(
-            device.name, {}
-        )[self.connection_name] = ncclient_connection
-        return ncclient_connection
+        return self.cache_connection("ncclient", device, ncclient_connection, pool_key)
+
+    def open_session(self, library, device, driver, connect):
+        session = (self.parent_runtime, library, device.name, self.connection_name)
+        env.acquire_session(session, device.name, library, driver)
+        try:
+            return connect()
+        except Exception:
+            env.release_session(session)
+            raise
+
+    def is_connection_alive(self, library, connection):
+        try:
+            if library == "napalm":
+                return connection.is_alive()
+            elif library == "ncclient":
+                return connection.connected
+            elif library == "netmiko":
+                connection.find_prompt()
+            else:
+                connection.get_prompt()
+            return True
+        except Exception:
+            return False
 
     def get_or_close_connection(self, library, device):
         connection = self.get_connection(library, device)
@@ -1163,25 +1926,64 @@ class Runner:
             return
         if self.start_new_connection:
             return self.disconnect(library, device, connection)
-        if library == "napalm":
-            if connection.is_alive():
-                return connection
-            else:
-                self.disconnect(library, device, connection)
-        elif library == "ncclient":
-            if connection.connected:
-                return connection
-            else:
-                self.disconnect(library, device, connection)
-        else:
-            try:
-                if library == "netmiko":
-                    connection.find_prompt()
-                else:
-                    connection.get_prompt()
-                return connection
-            except Exception:
-                self.disconnect(library, device, connection)
+        if self.is_connection_alive(library, connection):
+            return connection
+        self.disconnect(library, device, connection)
+
+    @property
+    def use_connection_pool(self):
+        return (
+            vs.settings["automation"]["connection_pool"]["active"]
+            and not getattr(self, "disable_connection_pool", False)
+            and not self.start_new_connection
+        )
+
+    def get_pool_key(self, library, device, driver, credentials):
+        if not self.use_connection_pool:
+            return
+        secret = credentials.get("password") or credentials["pkey"].get_base64()
+        digest = sha256(f"{credentials['username']}:{secret}".encode()).hexdigest()
+        return (device.name, library, driver, digest)
+
+    def get_pooled_connection(self, library, device, pool_key):
+        if not pool_key:
+            return
+        session = (self.parent_runtime, library, device.name, self.connection_name)
+        while True:
+            entry = env.checkout_connection(pool_key, session)
+            if not entry:
+                return
+            if self.is_connection_alive(library, entry["connection"]):
+                log = f"Using pooled {library} connection '{self.connection_name}'"
+                self.log("info", log, device)
+                return self.cache_connection(
+                    library, device, entry["connection"], pool_key
+                )
+            env.close_pooled_connection(entry, session)
+
+    def cache_connection(self, library, device, connection, pool_key=None):
+        vs.connections_cache[library][self.parent_runtime].setdefault(device.name, {})[
+            self.connection_name
+        ] = connection
+        if pool_key:
+            env.pooled_connection_keys[id(connection)] = pool_key
+        return connection
+
+    def release_connection(self, library, device, connection, connection_name=None):
+        connection_name = connection_name or getattr(self, "connection_name", "default")
+        pool_key = env.pooled_connection_keys.pop(id(connection), None)
+        if not pool_key or getattr(self, "close_connection", False):
+            return self.disconnect(library, device, connection, connection_name)
+        connections = vs.connections_cache[library][self.parent_runtime]
+        connections.get(device, {}).pop(connection_name, None)
+        env.checkin_connection(
+            pool_key,
+            connection,
+            partial(self.terminate_connection, library, connection),
+            (self.parent_runtime, library, device, connection_name),
+        )
+        log = f"{library} connection '{connection_name}' returned to the pool"
+        self.log("info", log, device)
 
     def get_connection(self, library, device, name=None):
         cache = vs.connections_cache[library].get(self.parent_runtime, {})
@@ -1192,16 +1994,16 @@ class Runner:
         for library in ("netmiko", "napalm", "scrapli", "ncclient"):
             connection = self.get_connection(library, device)
             if connection:
-                self.disconnect(library, device, connection)
+                self.release_connection(library, device, connection)
 
     def close_remaining_connections(self):
         threads = []
         for library in ("netmiko", "napalm", "scrapli", "ncclient"):
             device_connections = vs.connections_cache[library][self.parent_runtime]
             for device, connections in list(device_connections.items()):
-                for connection in list(connections.values()):
-                    args = (library, device, connection)
-                    thread = Thread(target=self.disconnect, args=args)
+                for connection_name, connection in list(connections.items()):
+                    args = (library, device, connection, connection_name)
+                    thread = Thread(target=self.release_connection, args=args)
                     thread.start()
                     threads.append(thread)
         for thread in threads:
@@ -1209,22 +2011,28 @@ class Runner:
         for library in ("netmiko", "napalm", "scrapli", "ncclient"):
             vs.connections_cache[library].pop(self.parent_runtime)
 
-    def disconnect(self, library, device, connection):
-        connection_name = getattr(self, "connection_name", "default")
+    @staticmethod
+    def terminate_connection(library, connection):
+        if library == "netmiko":
+            connection.disconnect()
+        elif library == "ncclient":
+            connection.close_session()
+        else:
+            connection.close()
+
+    def disconnect(self, library, device, connection, connection_name=None):
+        connection_name = connection_name or getattr(self, "connection_name", "default")
         connection_log = f"{library} connection '{connection_name}'"
+        env.pooled_connection_keys.pop(id(connection), None)
         try:
-            if library == "netmiko":
-                connection.disconnect()
-            elif library == "ncclient":
-                connection.close_session()
-            else:
-                connection.close()
-            vs.connections_cache[library][self.parent_runtime][device].pop(
-                connection_name
-            )
+            self.terminate_connection(library, connection)
+            connections = vs.connections_cache[library][self.parent_runtime]
+            connections.get(device, {}).pop(connection_name, None)
             self.log("info", f"Closed {connection_log}", device)
         except Exception as exc:
             self.log("error", f"Error while closing {connection_log} ({exc})", device)
+        session = (self.parent_runtime, library, device, connection_name)
+        env.release_session(session)
 
     def enter_remote_device(self, connection, device):
         if not getattr(self, "jump_on_connect", False):
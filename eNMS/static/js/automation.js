@@ -9,6 +9,7 @@ formProperties: true
 JSONEditor: false
 jsPanel: false
 page: false
+settings: false
 */
 
 import {
@@ -257,6 +258,28 @@ function showResult(id) {
   });
 }
 
+function appendRuntimes(id, runtimes) {
+  runtimes.forEach((runtime) => {
+    $(id).append($("<option></option>").attr("value", runtime[0]).text(runtime[1]));
+  });
+  if (runtimes.length >= settings.tables.runtime_page_size) {
+    $(id).append("<option value='more'>Load more...</option>");
+  }
+}
+
+function loadMoreRuntimes(id, service, runtime) {
+  $(`${id} option[value='more']`).remove();
+  const options = $(`${id} option`).map((_, option) => option.value);
+  call({
+    url: `/get_runtimes/${service.id}`,
+    data: { before: options.get().sort()[0] },
+    callback: (runtimes) => {
+      appendRuntimes(id, runtimes);
+      $(id).val(runtime).selectpicker("refresh");
+    },
+  });
+}
+
 export const showRuntimePanel = function (
   type,
   service,
@@ -389,16 +412,16 @@ export const showRuntimePanel = function (
         id: service.id,
         callback: function () {
           $(`#runtimes-${panelId}`).empty();
-          runtimes.forEach((runtime) => {
-            $(`#runtimes-${panelId}`).append(
-              $("<option></option>").attr("value", runtime[0]).text(runtime[1])
-            );
-          });
+          appendRuntimes(`#runtimes-${panelId}`, runtimes);
           if (!runtime || ["normal", "latest"].includes(runtime)) {
             runtime = runtimes[0][0];
           }
           $(`#runtimes-${panelId}`).val(runtime).selectpicker("refresh");
           $(`#runtimes-${panelId}`).on("change", function () {
+            if (this.value == "more") {
+              return loadMoreRuntimes(`#runtimes-${panelId}`, service, runtime);
+            }
+            runtime = this.value;
             displayFunction(service, this.value, true, table, true, fullResult);
           });
           displayFunction(service, runtime, null, table, false, fullResult);
@@ -417,6 +440,7 @@ function displayLogs(service, runtime, change) {
     editor = initCodeMirror(`service-logs-${service.id}`, "logs");
   }
   $(`#runtimes-logs-${service.id}`).on("change", function () {
+    if (this.value == "more") return;
     refreshLogs(service, this.value, editor, true);
   });
   refreshLogs(service, runtime, editor, true);
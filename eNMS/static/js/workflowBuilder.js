@@ -72,6 +72,7 @@ export let graph;
 
 let currentRun;
 let currentPlaceholder;
+let oldestRuntime;
 let placeholder;
 let isSuperworkflow;
 let runtimeDisplay;
@@ -135,6 +136,10 @@ function updateRuntimes(result) {
     const option = `<option value='${runtime[0]}'>${runtime[1]}</option>`;
     $("#current-runtime").append(option);
   });
+  oldestRuntime = result.runtimes.slice(-1)[0]?.[0];
+  if (result.more_runtimes) {
+    $("#current-runtime").append("<option value='more'>Load more...</option>");
+  }
   if (placeholder && currentPlaceholder) {
     nodes.update({
       id: placeholder.id,
@@ -194,6 +199,7 @@ export const switchToWorkflow = function (path, direction, runtime, selection) {
   }
   setPath(path);
   moveHistory(path, direction);
+  oldestRuntime = null;
   call({
     url: `/get_service_state/${path}`,
     data: { display: runtimeDisplay, runtime: runtime || "latest" },
@@ -680,7 +686,9 @@ export function resetWorkflowDisplay() {
 }
 
 export function getWorkflowState(periodic, first) {
-  const runtime = $("#current-runtime").val();
+  let runtime = $("#current-runtime").val();
+  const loadMore = runtime == "more";
+  if (loadMore) runtime = currentRuntime;
   if (userIsActive && workflow?.id && !first) {
     call({
       url: `/get_service_state/${currentPath}`,
@@ -688,6 +696,8 @@ export function getWorkflowState(periodic, first) {
         display: runtimeDisplay,
         runtime: runtime,
         device: $("#device-filter").val(),
+        oldest_runtime: oldestRuntime,
+        load_more: loadMore,
       },
       callback: function (result) {
         if (!Object.keys(result).length || result.service.id != workflow.id) return;
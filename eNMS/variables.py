@@ -127,6 +127,9 @@ class VariableStore:
         self.run_logs = defaultdict(lambda: defaultdict(list))
         self.run_stop = defaultdict(bool)
         self.run_instances = {}
+        self.run_credentials = defaultdict(
+            lambda: {"credentials": {}, "devices": {}, "errors": {}}
+        )
         libraries = ("netmiko", "napalm", "scrapli", "ncclient")
         self.connections_cache = {library: defaultdict(dict) for library in libraries}
         self.service_run_count = defaultdict(int)
@@ -6,3 +6,9 @@ preload_app = True
 raw_env = ["TERM=screen"]
 timeout = 3000
 workers = 1
+
+
+def post_fork(server, worker):
+    from eNMS.environment import env
+
+    env.restart_background_threads()
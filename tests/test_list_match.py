@@ -0,0 +1,68 @@
+from unittest import main, TestCase
+
+from eNMS.runner import ListMatch, Runner
+
+
+class ListMatchTest(TestCase):
+    def test_duplicates(self):
+        list_match = ListMatch(["a", "a", "b"])
+        list_match.remove("a")
+        list_match.remove("b")
+        self.assertTrue(list_match)
+        list_match.remove("a")
+        self.assertFalse(list_match)
+
+    def test_missing_item(self):
+        list_match = ListMatch(["a"])
+        list_match.remove("b")
+        list_match.remove({"b": 1})
+        self.assertEqual(list_match.hashable_items, {"a": 1})
+
+    def test_unhashable_items(self):
+        list_match = ListMatch([{"a": 1}, ["b"], {"a": 1}])
+        list_match.remove({"a": 1})
+        list_match.remove(["b"])
+        self.assertEqual(list_match.unhashable_items, [{"a": 1}])
+        list_match.remove({"a": 1})
+        self.assertFalse(list_match)
+
+    def test_copy(self):
+        list_match = ListMatch(["a", {"b": 1}])
+        list_match_copy = list_match.copy()
+        list_match_copy.remove("a")
+        list_match_copy.remove({"b": 1})
+        self.assertFalse(list_match_copy)
+        self.assertEqual(list_match.hashable_items, {"a": 1})
+        self.assertEqual(list_match.unhashable_items, [{"b": 1}])
+
+
+class DictionaryMatchTest(TestCase):
+    def setUp(self):
+        self.runner = Runner.__new__(Runner)
+        self.runner.__dict__["validation_method"] = "dict_included"
+
+    def match(self, result, match):
+        matcher = {
+            key: ListMatch(value) if isinstance(value, list) else value
+            for key, value in match.items()
+        }
+        return self.runner.match_dictionary(result, matcher)
+
+    def test_list_included(self):
+        self.assertTrue(self.match({"a": [1, 2, 3]}, {"a": [3, 1]}))
+        self.assertFalse(self.match({"a": [1, 2]}, {"a": [1, 1]}))
+        self.assertTrue(self.match({"a": [1, 2, 1]}, {"a": [1, 1]}))
+
+    def test_nested_list(self):
+        result = {"b": {"a": [{"c": 1}, {"d": 2}]}}
+        self.assertTrue(self.match(result, {"a": [{"d": 2}]}))
+        self.assertFalse(self.match(result, {"a": [{"e": 3}]}))
+
+    def test_matcher_reused(self):
+        matcher = {"a": ListMatch([1, 2])}
+        self.assertTrue(self.runner.match_dictionary({"a": [1, 2]}, matcher))
+        self.assertTrue(self.runner.match_dictionary({"a": [2, 1]}, matcher))
+
+
+if __name__ == "__main__":
+    main()
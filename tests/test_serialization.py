@@ -0,0 +1,75 @@
+from json import loads
+from tempfile import TemporaryDirectory
+from unittest import main, TestCase
+
+from eNMS.database import db
+
+RESULT = {"result": "x" * 200, "success": True, "duration": "0:00:01", "runtime": "1"}
+
+
+class SerializationTest(TestCase):
+    def setUp(self):
+        self.blob_store, self.directory = db.blob_store, TemporaryDirectory()
+        db.blob_store = {
+            **self.blob_store,
+            "active": True,
+            "compression": "zlib",
+            "inline_keys": ["duration", "runtime"],
+            "path": self.directory.name,
+            "threshold": 100,
+        }
+
+    def tearDown(self):
+        db.blob_store = self.blob_store
+        self.directory.cleanup()
+
+    def test_small_value(self):
+        value = {"result": "ok", "duration": "0:00:01", "runtime": "1"}
+        content = db.serialize(value)
+        self.assertEqual(loads(content), value)
+        self.assertIsNone(db.get_blob_hash(content))
+        self.assertEqual(db.deserialize(content), value)
+
+    def test_inline_keys_only(self):
+        value = {"runtime": "1"}
+        self.assertEqual(db.deserialize(db.serialize(value)), value)
+
+    def test_blob(self):
+        content = db.serialize(RESULT)
+        reference = loads(content)
+        blob_hash = db.get_blob_hash(content)
+        self.assertEqual(reference["__blob__"], blob_hash)
+        self.assertEqual(reference["runtime"], "1")
+        self.assertNotIn("result", reference)
+        self.assertEqual(db.deserialize(content), RESULT)
+        other_run = db.serialize({**RESULT, "runtime": "2", "duration": "0:00:02"})
+        self.assertEqual(db.get_blob_hash(other_run), blob_hash)
+        self.assertEqual(len(list(db.blob_path.glob("*/*"))), 1)
+
+    def test_missing_blob(self):
+        content = db.serialize(RESULT)
+        for path in db.blob_path.glob("*/*"):
+            path.unlink()
+        value = db.deserialize(content)
+        self.assertIn("error", value)
+        self.assertEqual(value["runtime"], "1")
+
+    def test_non_string_keys(self):
+        value = {("a", "b"): "x" * 200, "runtime": "1"}
+        content = db.serialize(value)
+        self.assertIsNone(db.get_blob_hash(content))
+        self.assertEqual(db.deserialize(content), value)
+
+    def test_non_json_values(self):
+        value = {"result": {1, 2}}
+        self.assertEqual(db.deserialize(db.serialize(value)), {"result": "{1, 2}"})
+
+    def test_inactive_blob_store(self):
+        db.blob_store["active"] = False
+        content = db.serialize(RESULT)
+        self.assertIsNone(db.get_blob_hash(content))
+        self.assertEqual(db.deserialize(content), RESULT)
+
+
+if __name__ == "__main__":
+    main()
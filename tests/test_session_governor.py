@@ -0,0 +1,84 @@
+from os import getenv
+from threading import Thread
+from time import sleep, time
+from unittest import main, skipUnless, TestCase
+from uuid import uuid4
+
+from eNMS.environment import env
+from eNMS.variables import vs
+
+
+class SessionGovernorTest(TestCase):
+    def setUp(self):
+        self.settings = vs.settings["automation"]["governor"]
+        vs.settings["automation"]["governor"] = {
+            **self.settings,
+            "active": True,
+            "acquire_timeout": 5,
+            "max_sessions_per_device": 1,
+            "poll_interval": 0.05,
+        }
+        self.redis_queue = env.redis_queue
+        env.init_session_governor()
+        self.device = f"device-{uuid4()}"
+
+    def tearDown(self):
+        for session in list(env.governed_sessions):
+            env.release_session(session)
+        env.redis_queue = self.redis_queue
+        vs.settings["automation"]["governor"] = self.settings
+        env.init_session_governor()
+
+    def acquire(self, session):
+        env.acquire_session(session, self.device, "netmiko", "cisco_ios")
+
+    def wait_for_queue(self, length):
+        key = f"governor/device/{self.device}"
+        start = time()
+        while len(env.session_queues.get(key, ())) < length:
+            self.assertLess(time() - start, 5)
+            sleep(0.01)
+
+    def test_fifo_order(self):
+        env.redis_queue, acquired = None, []
+
+        def acquire(session):
+            self.acquire(session)
+            acquired.append(session)
+
+        self.acquire("first")
+        threads = []
+        for index, session in enumerate(("second", "third"), 1):
+            threads.append(Thread(target=acquire, args=(session,)))
+            threads[-1].start()
+            self.wait_for_queue(index)
+        env.release_session("first")
+        threads[0].join(5)
+        self.assertEqual(acquired, ["second"])
+        env.release_session("second")
+        threads[1].join(5)
+        self.assertEqual(acquired, ["second", "third"])
+
+    def test_timeout(self):
+        env.redis_queue = None
+        vs.settings["automation"]["governor"]["acquire_timeout"] = 0.1
+        env.init_session_governor()
+        self.acquire("first")
+        with self.assertRaises(Exception):
+            self.acquire("second")
+        self.assertNotIn("second", env.governed_sessions)
+
+    @skipUnless(getenv("REDIS_ADDR"), "requires a Redis server")
+    def test_lease_expiry(self):
+        vs.settings["automation"]["governor"]["lease_ttl"] = 0.5
+        env.init_session_governor()
+        self.acquire("crashed")
+        env.governed_sessions.pop("crashed")
+        start = time()
+        self.acquire("second")
+        self.assertGreater(time() - start, 0.3)
+        self.assertIn("second", env.governed_sessions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+from time import time
+from types import SimpleNamespace
+from unittest import main, TestCase
+
+from eNMS.runner import Runner
+
+
+class StepRunner(Runner):
+    def __init__(self, device_steps, max_processes=2):
+        self.__dict__.update(
+            device_steps=device_steps, max_processes=max_processes, stopped=False
+        )
+
+    @property
+    def stop(self):
+        return self.stopped
+
+    def get(self, property):
+        return {"max_processes": self.max_processes, "multiprocessing_mode": None}[
+            property
+        ]
+
+    def log(self, *args, **kwargs):
+        pass
+
+    def get_result_step(self, steps, device_id=None):
+        steps = steps or self.device_steps[device_id](self)
+        return super().get_result_step(steps)
+
+
+def retries(name, *delays):
+    def steps(runner):
+        for delay in delays:
+            yield delay
+            if runner.stop:
+                return f"{name} (stopped)"
+        return name
+
+    return steps
+
+
+class ThreadPoolTest(TestCase):
+    def get_results(self, runner):
+        devices = [SimpleNamespace(id=device_id) for device_id in runner.device_steps]
+        return runner.get_thread_pool_results(devices)
+
+    def test_retry_order(self):
+        runner = StepRunner(
+            {
+                1: retries("a", 0.3),
+                2: retries("b"),
+                3: retries("c", 0.05, 0.05),
+            }
+        )
+        self.assertEqual(self.get_results(runner), ["b", "c", "a"])
+
+    def test_retries_do_not_hold_threads(self):
+        runner = StepRunner(
+            {device_id: retries(str(device_id), 0.2) for device_id in range(10)},
+            max_processes=1,
+        )
+        start = time()
+        self.assertCountEqual(self.get_results(runner), map(str, range(10)))
+        self.assertLess(time() - start, 1.5)
+
+    def test_stop(self):
+        def stop(runner):
+            runner.stopped = True
+            yield 60
+            return "stopped"
+
+        runner = StepRunner({1: stop, 2: retries("b", 60)})
+        start = time()
+        self.assertCountEqual(self.get_results(runner), ["stopped", "b (stopped)"])
+        self.assertLess(time() - start, 5)
+
+
+if __name__ == "__main__":
+    main()
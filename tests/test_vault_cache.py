@@ -0,0 +1,165 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from os import environ
+from threading import Thread
+from unittest import main, TestCase
+
+from eNMS.environment import env, INVALIDATE_VAULT_SECRET_SCRIPT
+from eNMS.variables import vs
+
+PASSWORD_PATH = "secret/data/device/router1/password"
+ENABLE_PATH = "secret/data/device/router1/enable_password"
+
+
+class VaultStandIn(BaseHTTPRequestHandler):
+
+    secrets, reads = {}, []
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, content=None):
+        body = b"" if content is None else dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # noqa: N802
+        path = self.path.split("?")[0][len("/v1/") :]
+        if path == "sys/seal-status":
+            return self.send_json(200, {"sealed": False})
+        self.reads.append(path)
+        if path not in self.secrets:
+            return self.send_json(404, {"errors": []})
+        self.send_json(200, {"data": {"data": self.secrets[path]}})
+
+    def do_POST(self):  # noqa: N802
+        length = int(self.headers["Content-Length"])
+        content = loads(self.rfile.read(length))
+        self.secrets[self.path[len("/v1/") :]] = content["data"]
+        self.send_json(204)
+
+    do_PUT = do_POST  # noqa: N815
+
+    def do_DELETE(self):  # noqa: N802
+        path = self.path[len("/v1/") :]
+        for secret_path in list(self.secrets):
+            if secret_path == path or secret_path.startswith(f"{path}/"):
+                del self.secrets[secret_path]
+        self.send_json(204)
+
+
+class RedisStandIn:
+    def __init__(self):
+        self.version, self.invalidations = 0, []
+
+    def eval(self, script, number_of_keys, *args):
+        if script == INVALIDATE_VAULT_SECRET_SCRIPT:
+            path, max_invalidations = args[number_of_keys:]
+            return self.invalidate(path, max_invalidations)
+        known_version = args[number_of_keys]
+        if self.version == known_version:
+            return [self.version]
+        behind = self.version - known_version
+        if known_version < 0 or behind < 0 or behind > len(self.invalidations):
+            return [self.version, 1]
+        return [self.version, 0, *self.invalidations[-behind:]]
+
+    def invalidate(self, path, max_invalidations=1000):
+        self.version += 1
+        self.invalidations = [*self.invalidations, path][-max_invalidations:]
+        return self.version
+
+
+class VaultCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), VaultStandIn)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        environ["VAULT_ADDR"] = f"http://127.0.0.1:{cls.server.server_port}"
+        environ.setdefault("VAULT_TOKEN", "token")
+        env.init_vault_client()
+        cls.cache_settings = vs.settings["vault"]["cache"]
+
+    @classmethod
+    def tearDownClass(cls):
+        vs.settings["vault"]["cache"] = cls.cache_settings
+        cls.server.shutdown()
+
+    def setUp(self):
+        vs.settings["vault"]["cache"] = {
+            **self.cache_settings,
+            "active": True,
+            "version_check_interval": 0,
+        }
+        VaultStandIn.secrets.clear()
+        VaultStandIn.reads.clear()
+        VaultStandIn.secrets[PASSWORD_PATH] = {"password": "password1"}
+        VaultStandIn.secrets[ENABLE_PATH] = {"enable_password": "enable1"}
+        self.redis_queue, env.redis_queue = env.redis_queue, RedisStandIn()
+        env.vault_cache.clear()
+        env.vault_cache_version, env.vault_cache_next_check = None, 0
+
+    def tearDown(self):
+        env.redis_queue = self.redis_queue
+
+    def read_password(self):
+        return env.read_vault_secret(PASSWORD_PATH)["data"]["data"]["password"]
+
+    def test_cache_hit(self):
+        self.assertEqual(self.read_password(), "password1")
+        self.assertEqual(self.read_password(), "password1")
+        self.assertEqual(VaultStandIn.reads, [PASSWORD_PATH])
+
+    def test_prefetch(self):
+        env.prefetch_vault_secrets([PASSWORD_PATH, ENABLE_PATH])
+        self.read_password()
+        env.read_vault_secret(ENABLE_PATH)
+        self.assertCountEqual(VaultStandIn.reads, [PASSWORD_PATH, ENABLE_PATH])
+
+    def test_write_invalidates_path(self):
+        self.read_password()
+        env.read_vault_secret(ENABLE_PATH)
+        env.write_vault_secret(PASSWORD_PATH, {"password": "password2"})
+        self.assertEqual(self.read_password(), "password2")
+        env.read_vault_secret(ENABLE_PATH)
+        self.assertEqual(
+            VaultStandIn.reads, [PASSWORD_PATH, ENABLE_PATH, PASSWORD_PATH]
+        )
+
+    def test_delete_invalidates_prefix(self):
+        self.read_password()
+        env.read_vault_secret(ENABLE_PATH)
+        env.delete_vault_secret("secret/data/device/router1")
+        self.assertIsNone(env.read_vault_secret(PASSWORD_PATH))
+        self.assertIsNone(env.read_vault_secret(ENABLE_PATH))
+
+    def test_version_bump(self):
+        self.read_password()
+        env.read_vault_secret(ENABLE_PATH)
+        VaultStandIn.secrets[PASSWORD_PATH] = {"password": "password2"}
+        self.assertEqual(self.read_password(), "password1")
+        env.redis_queue.invalidate(PASSWORD_PATH)
+        self.assertEqual(self.read_password(), "password2")
+        env.read_vault_secret(ENABLE_PATH)
+        self.assertEqual(
+            VaultStandIn.reads, [PASSWORD_PATH, ENABLE_PATH, PASSWORD_PATH]
+        )
+
+    def test_trimmed_invalidations(self):
+        self.read_password()
+        env.read_vault_secret(ENABLE_PATH)
+        for index in range(3):
+            env.redis_queue.invalidate(f"secret/data/device/router{index + 2}", 2)
+        self.read_password()
+        env.read_vault_secret(ENABLE_PATH)
+        self.assertEqual(
+            VaultStandIn.reads,
+            [PASSWORD_PATH, ENABLE_PATH, PASSWORD_PATH, ENABLE_PATH],
+        )
+
+
+if __name__ == "__main__":
+    main()
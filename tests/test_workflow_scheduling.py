@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+from unittest import main, TestCase
+
+from eNMS.models.services.workflow.workflow import Workflow
+
+
+def service(id, priority=1):
+    return SimpleNamespace(id=id, priority=priority)
+
+
+class ReadyServiceTest(TestCase):
+    def get_ready_service(self, pending, running=(), ancestors=None):
+        pending = {service.id: service for service in pending}
+        running = {index: service for index, service in enumerate(running)}
+        return Workflow.get_ready_service(pending, running, ancestors or {})
+
+    def test_ancestor_pending(self):
+        a, b = service(1), service(2, priority=10)
+        self.assertIs(self.get_ready_service([a, b], ancestors={2: {1}}), a)
+
+    def test_ancestor_running(self):
+        a, b = service(1), service(2)
+        self.assertIsNone(self.get_ready_service([b], [a], {2: {1}}))
+
+    def test_parallel_branches(self):
+        b, c = service(2), service(3, priority=5)
+        ancestors = {2: {1}, 3: {1}}
+        self.assertIs(self.get_ready_service([b, c], ancestors=ancestors), c)
+        self.assertIs(self.get_ready_service([b], [c], ancestors), b)
+
+    def test_service_running(self):
+        a = service(1)
+        self.assertIsNone(self.get_ready_service([a], [a]))
+
+    def test_self_loop(self):
+        a = service(1)
+        self.assertIs(self.get_ready_service([a], ancestors={1: {1}}), a)
+
+    def test_loop(self):
+        a, b = service(1), service(2, priority=3)
+        ancestors = {1: {1, 2}, 2: {1, 2}}
+        self.assertIs(self.get_ready_service([a, b], ancestors=ancestors), b)
+        c = service(3)
+        self.assertIsNone(self.get_ready_service([a, b], [c], ancestors))
+
+    def test_nothing_pending(self):
+        self.assertIsNone(self.get_ready_service([]))
+
+
+if __name__ == "__main__":
+    main()